@@ -0,0 +1,263 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL,'
+    ' accessed REAL NOT NULL, size INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE TABLE IF NOT EXISTS cache_size ('
+    ' id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO cache_size VALUES (0, 0)',
+    'CREATE TRIGGER IF NOT EXISTS cache_inserted AFTER INSERT ON cache'
+    ' BEGIN UPDATE cache_size SET total = total + new.size; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_deleted AFTER DELETE ON cache'
+    ' BEGIN UPDATE cache_size SET total = total - old.size; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_updated AFTER UPDATE OF size'
+    ' ON cache BEGIN UPDATE cache_size'
+    ' SET total = total + new.size - old.size; END',
+)
+UPSERT = (
+    'INSERT INTO cache (key, value, expires, accessed, size)'
+    ' VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET'
+    ' value = excluded.value, expires = excluded.expires,'
+    ' accessed = excluded.accessed, size = excluded.size'
+)
+ALIVE = '(expires IS NULL OR expires > ?)'
+# Время последнего чтения обновляется не чаще раза в столько секунд,
+# чтобы горячие ключи не превращали каждое чтение в запись.
+ACCESS_RESOLUTION = 10
+# Сколько параметров передавать в один запрос с IN.
+BATCH_SIZE = 500
+# Вытеснение освобождает место с запасом, чтобы не повторяться
+# на каждой записи.
+CULL_RATIO = 0.9
+
+
+class SQLiteCache(BaseCache):
+    """
+    Кэш в файле SQLite в режиме WAL, общий для всех процессов
+    на одном сервере: читатели не ждут писателя, а запись идёт
+    в транзакциях. Объём значений ограничен MAX_SIZE байт,
+    сверх него вытесняются давно не читанные ключи.
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.location = location
+        options = params.get('OPTIONS', {})
+        self.max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """
+        Соединение своё у каждого потока; после fork процесс
+        открывает новое, а не делит файловые блокировки с родителем.
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = self._connect()
+            local.pid = os.getpid()
+        return local.connection
+
+    def _connect(self):
+        directory = os.path.dirname(self.location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.location, timeout=30,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        with self._transaction(connection):
+            for statement in SCHEMA:
+                connection.execute(statement)
+        return connection
+
+    @contextmanager
+    def _transaction(self, connection=None):
+        """Транзакция, сразу берущая блокировку записи."""
+        connection = connection or self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _row(self, key, value, timeout, now):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+        return key, value, expires, now, len(key) + len(value)
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        row = self.connection.execute(
+            f'SELECT value, accessed FROM cache WHERE key = ? AND {ALIVE}',
+            (key, now)
+        ).fetchone()
+        if row is None:
+            return default
+        value, accessed = row
+        if now - accessed > ACCESS_RESOLUTION:
+            self.connection.execute(
+                'UPDATE cache SET accessed = ? WHERE key = ?', (now, key)
+            )
+        return pickle.loads(value)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        now = time.time()
+        found = {}
+        stale = []
+        names = list(keys)
+        for start in range(0, len(names), BATCH_SIZE):
+            batch = names[start:start + BATCH_SIZE]
+            rows = self.connection.execute(
+                'SELECT key, value, accessed FROM cache'
+                f' WHERE key IN ({", ".join("?" * len(batch))})'
+                f' AND {ALIVE}',
+                (*batch, now)
+            )
+            for key, value, accessed in rows:
+                found[keys[key]] = pickle.loads(value)
+                if now - accessed > ACCESS_RESOLUTION:
+                    stale.append((now, key))
+        if stale:
+            self.connection.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?', stale
+            )
+        return found
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self.connection.execute(
+            f'SELECT 1 FROM cache WHERE key = ? AND {ALIVE}',
+            (key, time.time())
+        ).fetchone() is not None
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._transaction() as connection:
+            connection.execute(UPSERT,
+                               self._row(key, value, timeout, time.time()))
+            self._cull(connection)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        rows = [self._row(self._key(key, version), value, timeout, now)
+                for key, value in data.items()]
+        with self._transaction() as connection:
+            connection.executemany(UPSERT, rows)
+            self._cull(connection)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Записывает значение, только если ключа нет или он истёк."""
+        key = self._key(key, version)
+        now = time.time()
+        with self._transaction() as connection:
+            added = connection.execute(
+                f'{UPSERT} WHERE cache.expires <= ?',
+                (*self._row(key, value, timeout, now), now)
+            ).rowcount == 1
+            if added:
+                self._cull(connection)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        return self.connection.execute(
+            f'UPDATE cache SET expires = ? WHERE key = ? AND {ALIVE}',
+            (self.get_backend_timeout(timeout), key, now)
+        ).rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        """
+        Увеличивает число под ключом. Чтение и запись идут в одной
+        транзакции с блокировкой записи, поэтому параллельные
+        увеличения из разных процессов не теряются.
+        """
+        key = self._key(key, version)
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                f'SELECT value FROM cache WHERE key = ? AND {ALIVE}',
+                (key, now)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            connection.execute(
+                'UPDATE cache SET value = ?, accessed = ?, size = ?'
+                ' WHERE key = ?',
+                (data, now, len(key) + len(data), key)
+            )
+        return value
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        return self.connection.execute(
+            'DELETE FROM cache WHERE key = ?', (key,)
+        ).rowcount == 1
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._transaction() as connection:
+            for start in range(0, len(keys), BATCH_SIZE):
+                batch = keys[start:start + BATCH_SIZE]
+                connection.execute(
+                    'DELETE FROM cache'
+                    f' WHERE key IN ({", ".join("?" * len(batch))})',
+                    batch
+                )
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+    def size(self):
+        """Суммарный объём ключей и значений в байтах."""
+        return self.connection.execute(
+            'SELECT total FROM cache_size'
+        ).fetchone()[0]
+
+    def _cull(self, connection):
+        """
+        Если объём превысил MAX_SIZE, удаляет истёкшие ключи, а затем
+        давно не читанные, пока объём не опустится ниже доли CULL_RATIO.
+        """
+        total = 'SELECT total FROM cache_size'
+        if connection.execute(total).fetchone()[0] <= self.max_size:
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?',
+            (time.time(),)
+        )
+        excess = (connection.execute(total).fetchone()[0]
+                  - self.max_size * CULL_RATIO)
+        rows = connection.execute(
+            'SELECT key, size FROM cache ORDER BY accessed'
+        )
+        victims = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        rows.close()
+        connection.executemany('DELETE FROM cache WHERE key = ?', victims)
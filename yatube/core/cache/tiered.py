@@ -0,0 +1,217 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SEQUENCE_KEY = 'tiered:sequence'
+LOG_KEY = 'tiered:log:{}'
+# Запись в журнале о полной очистке кэша.
+EVERYTHING = '*'
+# Сколько секунд живут записи журнала и сколько их читается за раз;
+# отставший сильнее процесс просто очищает свой кэш целиком.
+LOG_TIMEOUT = 60
+LOG_LIMIT = 500
+
+_MISSING = object()
+# Локальные кэши процесса по имени: экземпляры бэкенда создаются
+# в каждом потоке заново, а данные должны быть общими.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class LocalStore:
+    """
+    Ограниченный LRU-кэш процесса. Значения хранятся в pickle,
+    как в LocMemCache, чтобы вызывающий код не менял их на месте.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.sequence = None
+        self.next_poll = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return _MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout, max_entries):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def evict(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TieredCache(BaseCache):
+    """
+    Небольшой LRU-кэш процесса с коротким временем жизни перед любым
+    кэшем Django из CACHES (OPTIONS['CACHE']). Горячие ключи читаются
+    без обращения к общему кэшу. Каждая запись через этот бэкенд
+    попадает в журнал в общем кэше; процессы читают журнал не чаще
+    раза в POLL_INTERVAL секунд и выбрасывают изменённые ключи, так что
+    значение устаревает не дольше min(POLL_INTERVAL, LOCAL_TIMEOUT).
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.alias = options['CACHE']
+        self.local_timeout = float(options.get('LOCAL_TIMEOUT', 5))
+        self.poll_interval = float(options.get('POLL_INTERVAL', 1))
+        with _stores_lock:
+            self.store = _stores.setdefault((location, self.alias),
+                                            LocalStore())
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _key(self, key, version):
+        return self.shared.make_key(key, version=version)
+
+    def _remember(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            timeout = self.local_timeout
+        timeout = min(timeout, self.local_timeout)
+        if timeout > 0:
+            self.store.set(key, value, timeout, self._max_entries)
+
+    def _sync(self):
+        """Выбрасывает ключи, изменённые другими процессами."""
+        store = self.store
+        now = time.monotonic()
+        with store.lock:
+            if now < store.next_poll:
+                return
+            store.next_poll = now + self.poll_interval
+            last = store.sequence
+        sequence = self.shared.get(SEQUENCE_KEY)
+        if sequence == last:
+            return
+        store.sequence = sequence
+        if (sequence is None or last is None or sequence < last
+                or sequence - last > LOG_LIMIT):
+            store.clear()
+            return
+        names = [LOG_KEY.format(number)
+                 for number in range(last + 1, sequence + 1)]
+        log = self.shared.get_many(names)
+        if len(log) < len(names) or EVERYTHING in log.values():
+            # Журнал потерян или была очистка: доверять нечему.
+            store.clear()
+            return
+        store.evict(key for keys in log.values() for key in keys)
+
+    def _publish(self, keys):
+        """Выбрасывает ключи у себя и записывает их в журнал."""
+        if keys == EVERYTHING:
+            self.store.clear()
+        else:
+            self.store.evict(keys)
+        try:
+            sequence = self.shared.incr(SEQUENCE_KEY)
+        except ValueError:
+            # Начало от времени, чтобы номер не совпал с уже виденным.
+            sequence = int(time.time() * 1000)
+            if not self.shared.add(SEQUENCE_KEY, sequence, None):
+                sequence = self.shared.incr(SEQUENCE_KEY)
+        self.shared.set(LOG_KEY.format(sequence), keys, LOG_TIMEOUT)
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        local_key = self._key(key, version)
+        value = self.store.get(local_key)
+        if value is _MISSING:
+            value = self.shared.get(key, _MISSING, version=version)
+            if value is _MISSING:
+                return default
+            self._remember(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.store.get(self._key(key, version))
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            fetched = self.shared.get_many(missing, version=version)
+            for key, value in fetched.items():
+                self._remember(self._key(key, version), value)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        self._sync()
+        if self.store.get(self._key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self._publish([self._key(key, version)])
+        self._remember(self._key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        self._publish([self._key(key, version) for key in data])
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._publish([self._key(key, version)])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = self.shared.touch(key, timeout, version=version)
+        self._publish([self._key(key, version)])
+        return touched
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        self._publish([self._key(key, version)])
+        return value
+
+    def delete(self, key, version=None):
+        deleted = self.shared.delete(key, version=version)
+        self._publish([self._key(key, version)])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version=version)
+        self._publish([self._key(key, version) for key in keys])
+
+    def clear(self):
+        # Номер в журнале переживает очистку, иначе процесс, видевший
+        # такой же номер до неё, не заметит изменений.
+        sequence = self.shared.get(SEQUENCE_KEY)
+        self.shared.clear()
+        if sequence is not None:
+            self.shared.add(SEQUENCE_KEY, sequence, None)
+        self._publish(EVERYTHING)
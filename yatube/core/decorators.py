@@ -0,0 +1,96 @@
+import logging
+from contextlib import contextmanager
+from functools import wraps
+from time import monotonic
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT',
+                          'ROLLBACK TO SAVEPOINT')
+# Через сколько инструкций SQLite проверять срок долгого запроса.
+PROGRESS_STEPS = 1000
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление выполнило больше запросов к БД, чем разрешено."""
+
+
+class LatencyBudgetExceeded(OperationalError):
+    """Запросы к БД не уложились в отведённое время."""
+
+
+def query_budget(limit):
+    """
+    Декоратор, ограничивающий число запросов к БД, которое делает
+    представление вместе с отрисовкой шаблона.
+    При QUERY_BUDGET_STRICT превышение — ошибка, иначе — запись в лог.
+    Представление может расширить бюджет для конкретного запроса,
+    записав число дополнительных запросов в request.extra_queries.
+    Управление транзакциями и запросы к таблицам из QUERY_BUDGET_IGNORE
+    не учитываются.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                ignored = sql.startswith(TRANSACTION_STATEMENTS) or any(
+                    table in sql for table in settings.QUERY_BUDGET_IGNORE
+                )
+                if not ignored:
+                    queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count):
+                response = view(request, *args, **kwargs)
+            budget = limit + getattr(request, 'extra_queries', 0)
+            if len(queries) > budget:
+                message = (f'{view.__name__}: {len(queries)} запросов '
+                           f'к БД при бюджете {budget}')
+                if settings.QUERY_BUDGET_STRICT:
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return response
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def latency_budget(seconds):
+    """
+    Ограничивает время запросов к БД внутри блока. Запрос после срока
+    не выполняется. В SQLite долгий запрос прерывается, а ожидание
+    блокировки длится не дольше оставшегося времени.
+    Превышение — LatencyBudgetExceeded.
+    """
+    deadline = monotonic() + seconds
+
+    def guard(execute, sql, params, many, context):
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise LatencyBudgetExceeded(f'Бюджет {seconds} с исчерпан')
+        if connection.vendor != 'sqlite':
+            return execute(sql, params, many, context)
+        raw = connection.connection
+        busy_timeout = raw.execute('PRAGMA busy_timeout').fetchone()[0]
+        raw.execute(f'PRAGMA busy_timeout = {int(remaining * 1000)}')
+        raw.set_progress_handler(lambda: monotonic() > deadline,
+                                 PROGRESS_STEPS)
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if monotonic() > deadline:
+                raise LatencyBudgetExceeded(
+                    f'Бюджет {seconds} с исчерпан'
+                ) from error
+            raise
+        finally:
+            raw.set_progress_handler(None, 0)
+            raw.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+
+    with connection.execute_wrapper(guard):
+        yield
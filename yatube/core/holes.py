@@ -0,0 +1,27 @@
+import re
+
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+START = '<!--personal:{}-->'
+END = '<!--/personal-->'
+HOLE = re.compile(r'<!--personal:(?P<name>[\w/.-]+)-->.*?<!--/personal-->',
+                  re.S)
+
+
+def mark(name, content):
+    """Обрамляет личный фрагмент страницы метками с именем шаблона."""
+    return mark_safe(START.format(name) + content + END)
+
+
+def punch(content, request):
+    """
+    Перерисовывает личные фрагменты закэшированной страницы
+    под текущий запрос. Фрагменты зависят только от запроса
+    и пользователя, поэтому им хватает контекст-процессоров.
+    """
+    return HOLE.sub(
+        lambda match: mark(match['name'],
+                           render_to_string(match['name'], request=request)),
+        content
+    )
@@ -1,4 +1,7 @@
 from django import template
+from django.template.loader import get_template
+
+from core import holes
 
 register = template.Library()
 
@@ -6,3 +9,22 @@ register = template.Library()
 @register.filter
 def addclass(field, css):
     return field.as_widget(attrs={'class': css})
+
+
+@register.simple_tag(takes_context=True)
+def query_replace(context, **kwargs):
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        query[key] = value
+    return query.urlencode()
+
+
+@register.simple_tag(takes_context=True)
+def personal(context, template_name):
+    """
+    Включает личный фрагмент страницы (шапку, переключатель лент).
+    Фрагмент помечается, чтобы закэшированную страницу можно было
+    отдать другому пользователю, перерисовав только его.
+    """
+    content = get_template(template_name).template.render(context)
+    return holes.mark(template_name, content)
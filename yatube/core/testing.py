@@ -0,0 +1,38 @@
+import copy
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+@contextmanager
+def test_environment():
+    """
+    Настройки на время прогона тестов. Тесты чистят кэш, поэтому
+    у прогона своя база кэша во временном каталоге. Миниатюры строятся
+    в процессе: пул запускается через spawn и не видит тестовую базу.
+    """
+    directory = tempfile.mkdtemp(prefix='yatube-cache-')
+    caches = copy.deepcopy(settings.CACHES)
+    caches['shared']['LOCATION'] = os.path.join(directory, 'cache.sqlite3')
+    try:
+        with override_settings(CACHES=caches, THUMBNAIL_WORKERS=0):
+            yield
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    """Запуск manage.py test в окружении test_environment."""
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._environment = test_environment()
+        self._environment.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self._environment.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
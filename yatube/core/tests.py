@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.cache import sqlite, tiered
+from core.cache.sqlite import SQLiteCache
+from core.cache.tiered import TieredCache
+from core.decorators import LatencyBudgetExceeded, latency_budget
+
+SLOW_QUERY = (
+    'WITH RECURSIVE numbers(x) AS (SELECT 1 UNION ALL '
+    'SELECT x + 1 FROM numbers) '
+    'SELECT count(*) FROM (SELECT x FROM numbers LIMIT 1000000000)'
+)
+
+
+def increment(location, times):
+    cache = SQLiteCache(location, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_values_survive_between_instances(self):
+        """Второй экземпляр на том же файле видит записанное первым."""
+        self.cache.set('key', {'value': [1, 2]})
+        self.cache.set_many({'a': 1, 'b': 2})
+        other = SQLiteCache(self.location, {})
+        self.assertEqual(other.get('key'), {'value': [1, 2]})
+        self.assertEqual(other.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_add_and_expiry(self):
+        """add не перезаписывает живой ключ, но занимает истёкший."""
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+        self.cache.set('key', 1, timeout=0)
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.cache.add('key', 3))
+        self.assertEqual(self.cache.get('key'), 3)
+
+    def test_incr_is_atomic_across_processes(self):
+        """Увеличения из нескольких процессов не теряются."""
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=increment,
+                                   args=(self.location, 50))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_size_cap_evicts_least_recently_used(self):
+        """Сверх MAX_SIZE вытесняются давно не читанные ключи."""
+        cache = SQLiteCache(self.location, {'OPTIONS': {'MAX_SIZE': 5000}})
+        now = time.time()
+        with mock.patch.object(sqlite.time, 'time', return_value=now):
+            for number in range(4):
+                cache.set(f'key{number}', 'x' * 1000)
+        with mock.patch.object(sqlite.time, 'time',
+                               return_value=now + 60):
+            cache.get('key0')
+            cache.set('key4', 'x' * 1000)
+            cache.set('key5', 'x' * 1000)
+        self.assertLessEqual(cache.size(), 5000)
+        self.assertIsNotNone(cache.get('key0'))
+        self.assertIsNone(cache.get('key1'))
+        self.assertIsNotNone(cache.get('key5'))
+        cache.clear()
+        self.assertEqual(cache.size(), 0)
+
+    def test_tests_do_not_use_project_cache(self):
+        """Тесты работают с временной базой кэша, а не с файлом проекта."""
+        location = caches['shared'].location
+        self.assertFalse(location.startswith(settings.BASE_DIR))
+        self.assertTrue(location.startswith(tempfile.gettempdir()))
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings = override_settings(CACHES={'shared': {
+            'BACKEND': 'core.cache.sqlite.SQLiteCache',
+            'LOCATION': os.path.join(self.directory, 'cache.sqlite3'),
+        }})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.shared = caches['shared']
+        # Два «процесса»: у каждого свой локальный кэш.
+        self.worker, self.sibling = (
+            TieredCache(name, {'OPTIONS': {
+                'CACHE': 'shared', 'POLL_INTERVAL': 0, 'MAX_ENTRIES': 2,
+            }})
+            for name in ('worker', 'sibling')
+        )
+        self.addCleanup(tiered._stores.clear)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_reads_are_served_from_local_store(self):
+        """Повторное чтение не ходит в общий кэш."""
+        self.shared.set('key', 'value')
+        self.assertEqual(self.worker.get('key'), 'value')
+        with mock.patch.object(self.shared, 'get_many', return_value={}), \
+                mock.patch.object(self.shared, 'get') as shared_get:
+            shared_get.return_value = None
+            self.assertEqual(self.worker.get('key'), 'value')
+        shared_get.assert_called_once_with(tiered.SEQUENCE_KEY)
+
+    def test_writes_evict_key_in_other_processes(self):
+        """Запись и удаление в одном процессе видны в другом."""
+        self.sibling.set('key', 1)
+        self.assertEqual(self.worker.get('key'), 1)
+        self.sibling.set('key', 2)
+        self.assertEqual(self.worker.get('key'), 2)
+        self.sibling.incr('key')
+        self.assertEqual(self.worker.get('key'), 3)
+        self.sibling.delete('key')
+        self.assertIsNone(self.worker.get('key'))
+
+    def test_clear_and_lost_log_empty_local_store(self):
+        """После очистки или потери журнала локальный кэш пуст."""
+        self.sibling.set('key', 1)
+        self.assertEqual(self.worker.get('key'), 1)
+        self.sibling.clear()
+        self.shared.set('key', 2)
+        self.assertEqual(self.worker.get('key'), 2)
+        self.shared.set('key', 3)
+        self.sibling.set('other', 1)
+        self.shared.delete(tiered.LOG_KEY.format(
+            self.shared.get(tiered.SEQUENCE_KEY)
+        ))
+        self.assertEqual(self.worker.get('key'), 3)
+
+    def test_local_store_is_bounded(self):
+        """Локальный кэш держит MAX_ENTRIES ключей и короткое время."""
+        self.shared.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.worker.get_many(['a', 'b', 'c'])
+        self.assertEqual(list(self.worker.store.entries),
+                         [self.shared.make_key(key) for key in 'bc'])
+        now = time.monotonic()
+        with mock.patch.object(tiered.time, 'monotonic',
+                               return_value=now + 10):
+            self.assertIs(self.worker.store.get(self.shared.make_key('c')),
+                          tiered._MISSING)
+
+
+def select_one():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        return cursor.fetchone()[0]
+
+
+class LatencyBudgetTest(TestCase):
+    def test_queries_within_budget(self):
+        """Быстрые запросы в бюджете выполняются как обычно."""
+        with latency_budget(10):
+            self.assertEqual(select_one(), 1)
+        self.assertEqual(select_one(), 1)
+
+    def test_query_after_deadline_is_not_run(self):
+        """Запрос после срока не выполняется."""
+        with self.assertRaises(LatencyBudgetExceeded):
+            with latency_budget(0):
+                select_one()
+
+    def test_slow_query_is_interrupted(self):
+        """Долгий запрос прерывается по сроку."""
+        started = time.monotonic()
+        with self.assertRaises(LatencyBudgetExceeded):
+            with latency_budget(0.1), connection.cursor() as cursor:
+                cursor.execute(SLOW_QUERY)
+        self.assertLess(time.monotonic() - started, 5)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Post, Group, Comment, Follow
+from .models import Post, Group, Comment, Follow, Tag
+from .search import search_posts
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -15,6 +16,11 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_posts(search_term, queryset), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('title',
@@ -43,7 +49,16 @@ class FollowAdmin(admin.ModelAdmin):
                     )
 
 
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name',
+                    'posts_count',
+                    )
+    search_fields = ('name',)
+    readonly_fields = ('posts_count',)
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(Tag, TagAdmin)
@@ -0,0 +1,362 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from functools import partial, wraps
+from hashlib import md5
+from importlib import import_module
+from itertools import product
+from math import log
+from random import random
+from time import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import OperationalError, connections
+from django.http import HttpResponse
+
+from core import holes
+from core.decorators import latency_budget
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'cache_version:{}'
+FEED_COUNT_KEY = 'feed_count:{}'
+PAGE_KEY = 'page:{}:{}'
+LOCK_KEY = 'lock:{}'
+STATS_KEY = 'cache_stats:{}:{}'
+CARD_KEY = 'post_card:{}:{}{}{}:{}'
+# Пути fetch: свежее значение, устаревшее под чужой блокировкой,
+# устаревшее с перерисовкой в фоне, перерисовка по истечении,
+# досрочная перерисовка и холодный промах; и устаревшая страница
+# вместо ошибки БД.
+OUTCOMES = ('hit', 'stale', 'refresh', 'expired', 'early', 'miss',
+            'fallback')
+RENDERED = ('expired', 'early', 'miss')
+
+_refresher = None
+_counters = Counter()
+_counters_lock = threading.Lock()
+_flushed_at = time()
+
+
+def get_version(name):
+    """
+    Текущая версия группы закэшированных фрагментов. Версия входит
+    в ключ фрагмента, поэтому её смена делает старые фрагменты
+    недостижимыми без перебора ключей.
+    """
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        # Начальное значение от времени, чтобы после вытеснения ключа
+        # версия не совпала с версией ещё живых фрагментов.
+        cache.add(key, int(time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Сбрасывает все фрагменты группы, меняя её версию."""
+    key = VERSION_KEY.format(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time() * 1000), None)
+
+
+def invalidate_counts(*feeds):
+    """Сбрасывает закэшированное число постов в лентах."""
+    cache.delete_many([FEED_COUNT_KEY.format(feed) for feed in feeds])
+
+
+def card_key(post, show_link, show_group, separator=False):
+    """
+    Ключ карточки: id поста и отпечаток всего, что на ней выводится,
+    поэтому изменённый пост сам получает новый ключ.
+    """
+    author = post.author
+    marker = [post.text, post.pub_date.isoformat(), post.image.name,
+              post.image_placeholder, author.username,
+              author.get_full_name()]
+    if show_group and post.group_id:
+        marker.append(post.group.slug)
+    digest = md5('\0'.join(marker).encode()).hexdigest()
+    return CARD_KEY.format(post.id, int(show_link), int(show_group),
+                           int(separator), digest)
+
+
+def invalidate_cards(post):
+    """Сбрасывает все закэшированные карточки поста."""
+    cache.delete_many([card_key(post, *flags)
+                       for flags in product((False, True), repeat=3)])
+
+
+def post_feeds(author_id, group_id):
+    """Ленты, в которые попадает пост (кроме лент подписчиков)."""
+    feeds = ['global', f'author:{author_id}']
+    if group_id:
+        feeds.append(f'group:{group_id}')
+    return feeds
+
+
+def record(name, outcome):
+    """
+    Считает, каким путём fetch отдал значение. Счётчики копятся
+    в процессе и раз в CACHE_STATS_INTERVAL секунд добавляются
+    в общий кэш, чтобы попадание не превращалось в запись.
+    """
+    global _flushed_at
+    with _counters_lock:
+        _counters[name, outcome] += 1
+        if time() - _flushed_at < settings.CACHE_STATS_INTERVAL:
+            return outcome
+        counters = dict(_counters)
+        _counters.clear()
+        _flushed_at = time()
+    for (counter_name, counter_outcome), count in counters.items():
+        key = STATS_KEY.format(counter_name, counter_outcome)
+        if not cache.add(key, count, None):
+            cache.incr(key, count)
+    return outcome
+
+
+def stats(names):
+    """Сброшенные в кэш счётчики путей fetch по именам."""
+    keys = {STATS_KEY.format(name, outcome): (name, outcome)
+            for name in names for outcome in OUTCOMES}
+    found = cache.get_many(keys)
+    return {name: {outcome: found.get(STATS_KEY.format(name, outcome), 0)
+                   for outcome in OUTCOMES}
+            for name in names}
+
+
+def log_failure(log, message):
+    """Колбэк для Future фоновой задачи: пишет её исключение в log."""
+    def callback(future):
+        error = future.exception()
+        if error is not None:
+            log.error(message, exc_info=error)
+    return callback
+
+
+def _in_thread(task):
+    try:
+        task()
+    finally:
+        connections.close_all()
+
+
+def queue_refresh(task):
+    """
+    Ставит перерисовку в пул потоков процесса. Без пула
+    (PAGE_REFRESH_WORKERS = 0) ничего не делает и возвращает False.
+    """
+    global _refresher
+    if not settings.PAGE_REFRESH_WORKERS:
+        return False
+    if _refresher is None:
+        _refresher = ThreadPoolExecutor(
+            max_workers=settings.PAGE_REFRESH_WORKERS,
+            thread_name_prefix='page-refresh',
+        )
+    _refresher.submit(_in_thread, task).add_done_callback(
+        log_failure(logger, 'Не удалось обновить страницу')
+    )
+    return True
+
+
+def _render(key, version, render, timeout, lock=None):
+    """Отрисовывает значение, кладёт его в кэш и снимает блокировку."""
+    started = time()
+    try:
+        value = render()
+        if value is not None:
+            finished = time()
+            cache.set(key, (value, version, finished + timeout,
+                            finished - started),
+                      timeout + settings.CACHE_STALE_TIMEOUT)
+    finally:
+        if lock is not None:
+            cache.delete(lock)
+    return value
+
+
+def fetch(key, version, render, timeout, name, budget=None):
+    """
+    Значение из кэша с защитой от одновременной перерисовки.
+    Значение хранится вместе с версией, сроком свежести и временем
+    отрисовки, а живёт дольше срока на CACHE_STALE_TIMEOUT. Устаревшее
+    (по сроку или по версии) значение перерисовывает только получивший
+    блокировку запрос, остальные получают старое. Незадолго до срока
+    значение с вероятностью, растущей ко сроку и со временем отрисовки,
+    перерисовывается досрочно (XFetch). Если render вернул None,
+    результат не кэшируется.
+    С budget (секунды) получивший блокировку тоже не ждёт: значение,
+    устаревшее по сроку, перерисовывается в фоне, а устаревшее по версии
+    рисуется с бюджетом времени на запросы к БД; при ошибке БД
+    или превышении бюджета отдаётся старое и перерисовка уходит в фон.
+    Возвращает значение и путь, которым оно получено (из OUTCOMES).
+    """
+    envelope = cache.get(key)
+    if envelope is None:
+        return _render(key, version, render, timeout), record(name, 'miss')
+    value, stored_version, expires, delta = envelope
+    now = time()
+    fresh = stored_version == version and now < expires
+    early = now - delta * settings.CACHE_EARLY_BETA * log(1 - random())
+    if fresh and early < expires:
+        return value, record(name, 'hit')
+    lock = LOCK_KEY.format(key)
+    if not cache.add(lock, 1, settings.CACHE_LOCK_TIMEOUT):
+        return value, record(name, 'hit' if fresh else 'stale')
+    if budget is None:
+        return (_render(key, version, render, timeout, lock),
+                record(name, 'early' if fresh else 'expired'))
+    refresh = partial(_render, key, version, render, timeout, lock)
+    if stored_version == version and queue_refresh(refresh):
+        return value, record(name, 'hit' if fresh else 'refresh')
+    try:
+        with latency_budget(budget):
+            return (_render(key, version, render, timeout, lock),
+                    record(name, 'early' if fresh else 'expired'))
+    except OperationalError:
+        logger.warning('%s: отдано устаревшее значение', name,
+                       exc_info=True)
+        if cache.add(lock, 1, settings.CACHE_LOCK_TIMEOUT) and not (
+                queue_refresh(refresh)):
+            cache.delete(lock)
+        return value, record(name, 'fallback')
+
+
+def page_key(name, request):
+    """Ключ страницы: представление и полный путь."""
+    path = md5(request.get_full_path().encode()).hexdigest()
+    return PAGE_KEY.format(name, path)
+
+
+def fresh(key, version):
+    """Значение из fetch, если оно не устарело; иначе None."""
+    envelope = cache.get(key)
+    if envelope is None:
+        return None
+    value, stored_version, expires, _ = envelope
+    if stored_version != version or expires <= time():
+        return None
+    return value
+
+
+def last(key):
+    """Последнее значение из fetch, даже устаревшее."""
+    envelope = cache.get(key)
+    return None if envelope is None else envelope[0]
+
+
+def cached_response(content, state):
+    response = HttpResponse(content)
+    response['X-Page-Cache'] = state
+    return response
+
+
+def cacheable(response):
+    """Содержимое ответа для кэша страниц или None, если его не кэшируют."""
+    if response.status_code == 200 and not response.cookies:
+        return response.content.decode()
+    return None
+
+
+def _anonymous_page(name, fallback, view, key, request, *args, **kwargs):
+    """Страница для анонимного запроса через fetch."""
+    rendered = []
+
+    def render():
+        response = view(request, *args, **kwargs)
+        rendered.append(response)
+        return cacheable(response)
+
+    budget = settings.PAGE_LATENCY_BUDGET if fallback else None
+    content, outcome = fetch(key, get_version('pages'), render,
+                             settings.PAGE_CACHE_TIMEOUT, name, budget)
+    if outcome not in RENDERED:
+        return cached_response(content,
+                               'hit' if outcome == 'hit' else 'stale')
+    response = rendered[0]
+    if content is not None:
+        response['X-Page-Cache'] = 'miss'
+    return response
+
+
+def _queue_anonymous_render(view, key, request, *args, **kwargs):
+    """
+    Ставит в фон перерисовку общей страницы от имени анонима, чтобы
+    после ошибки БД её обновил не только анонимный запрос.
+    """
+    lock = LOCK_KEY.format(key)
+    if not cache.add(lock, 1, settings.CACHE_LOCK_TIMEOUT):
+        return
+    anonymous = copy(request)
+    anonymous.user = AnonymousUser()
+    anonymous.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    anonymous.COOKIES = {}
+
+    def render():
+        return cacheable(view(anonymous, *args, **kwargs))
+
+    refresh = partial(_render, key, get_version('pages'), render,
+                      settings.PAGE_CACHE_TIMEOUT, lock)
+    if not queue_refresh(refresh):
+        cache.delete(lock)
+
+
+def _shared_page(name, fallback, view, key, request, *args, **kwargs):
+    """
+    Свежая общая страница с личными фрагментами под запрос; если её
+    нет, страница рисуется для пользователя. С fallback это делается
+    с бюджетом времени, и при ошибке БД отдаётся последняя отрисовка,
+    а общая страница перерисовывается в фоне.
+    """
+    content = fresh(key, get_version('pages'))
+    if content is not None:
+        return cached_response(holes.punch(content, request), 'hit')
+    content = last(key) if fallback else None
+    if content is None:
+        return view(request, *args, **kwargs)
+    try:
+        with latency_budget(settings.PAGE_LATENCY_BUDGET):
+            return view(request, *args, **kwargs)
+    except OperationalError:
+        logger.warning('%s: отдана устаревшая страница', name,
+                       exc_info=True)
+        record(name, 'fallback')
+        _queue_anonymous_render(view, key, request, *args, **kwargs)
+        return cached_response(holes.punch(content, request), 'stale')
+
+
+def page_cache(name, shared=False, fallback=False):
+    """
+    Декоратор, кэширующий страницу целиком для анонимных запросов.
+    Со shared закэшированная страница отдаётся и авторизованным:
+    личные фрагменты из тега personal перерисовываются под запрос.
+    Без shared авторизованные получают страницу без кэша — у таких
+    представлений личное содержимое есть и вне фрагментов.
+    Страница устаревает со сменой версии 'pages' при изменении данных;
+    перерисовывает её один анонимный запрос, остальные получают
+    прежнюю с X-Page-Cache: stale.
+    С fallback запрос с прежней отрисовкой не ждёт БД дольше
+    PAGE_LATENCY_BUDGET: при ошибке БД или превышении бюджета
+    отдаётся прежняя отрисовка с X-Page-Cache: stale (см. fetch).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            anonymous = not request.user.is_authenticated
+            if request.method not in ('GET', 'HEAD') or not (
+                    anonymous or shared):
+                return view(request, *args, **kwargs)
+            page = _anonymous_page if anonymous else _shared_page
+            return page(name, fallback, view, page_key(name, request),
+                        request, *args, **kwargs)
+        return wrapper
+    return decorator
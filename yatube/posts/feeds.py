@@ -0,0 +1,188 @@
+from django.conf import settings
+from django.db.models import F, Q
+
+from .caching import invalidate_counts
+from .models import AuthorStats, Follow, Post, TimelineEntry
+
+
+def is_celebrity(author_id):
+    """
+    Посты авторов с большим числом подписчиков не раскладываются
+    по лентам, а подтягиваются при чтении.
+    """
+    return AuthorStats.objects.filter(author=author_id,
+                                      celebrity=True).exists()
+
+
+def celebrities(user):
+    """
+    Авторы из подписок пользователя, чьи посты читаются при запросе ленты.
+    """
+    return list(
+        Follow.objects.filter(
+            user=user, author__stats__celebrity=True
+        ).values_list('author', flat=True)
+    )
+
+
+def followed(author_id):
+    """
+    Учитывает нового подписчика. Автор, набравший
+    FEED_CELEBRITY_THRESHOLD подписчиков, сразу становится «звездой»:
+    это одно обновление строки, а прежние записи его постов в лентах
+    убирает rebalance_timelines.
+    """
+    AuthorStats.change_followers_count(author_id, 1)
+    AuthorStats.objects.filter(
+        author=author_id,
+        celebrity=False,
+        followers_count__gte=settings.FEED_CELEBRITY_THRESHOLD
+    ).update(celebrity=True)
+
+
+def unfollowed(author_id):
+    """
+    Учитывает отписку. Перестать быть «звездой» автор может только
+    в rebalance_timelines: для этого посты раскладываются всем
+    подписчикам, и делать это в запросе слишком дорого.
+    """
+    AuthorStats.change_followers_count(author_id, -1)
+
+
+def invalidate_followers(author_id):
+    """
+    Сбрасывает число постов в лентах подписчиков автора. Для «звёзд»
+    сброс не делается: ленты их подписчиков обновятся по таймауту.
+    """
+    if is_celebrity(author_id):
+        return
+    followers = Follow.objects.filter(
+        author=author_id
+    ).values_list('user_id', flat=True)
+    invalidate_counts(*[f'follower:{user_id}' for user_id in followers])
+
+
+def fan_out(post):
+    """
+    Раскладывает новый пост по лентам всех подписчиков автора.
+    """
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id,
+                       post=post,
+                       author_id=post.author_id,
+                       pub_date=post.pub_date) for user_id in followers],
+        ignore_conflicts=True
+    )
+
+
+def _push(user_id, author_id, posts):
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id,
+                       post_id=post_id,
+                       author_id=author_id,
+                       pub_date=pub_date) for post_id, pub_date in posts],
+        ignore_conflicts=True
+    )
+
+
+def backfill(follow):
+    """
+    Добавляет в ленту подписчика уже опубликованные посты автора.
+    """
+    if is_celebrity(follow.author_id):
+        return
+    posts = Post.objects.filter(
+        author=follow.author_id
+    ).values_list('id', 'pub_date')
+    _push(follow.user_id, follow.author_id, posts)
+
+
+def prune(follow):
+    """
+    Удаляет из ленты подписчика посты автора.
+    """
+    TimelineEntry.objects.filter(user=follow.user_id,
+                                 author=follow.author_id).delete()
+
+
+def rebalance(author_id):
+    """
+    Переключает автора по порогам «звёзд» с гистерезисом: «звездой»
+    он становится при FEED_CELEBRITY_THRESHOLD подписчиков, а обратно
+    возвращается, только опустившись ниже FEED_CELEBRITY_LOW_THRESHOLD
+    (но не выше верхнего порога).
+    У «звезды» записи лент удаляются; вернувшийся автор раскладывается
+    по лентам всех подписчиков. Вызывается из rebalance_timelines,
+    а не в запросе: это O(подписчиков) запросов.
+    """
+    stats = AuthorStats.for_author(author_id)
+    low = min(settings.FEED_CELEBRITY_LOW_THRESHOLD,
+              settings.FEED_CELEBRITY_THRESHOLD)
+    celebrity = stats.celebrity
+    if celebrity and stats.followers_count < low:
+        celebrity = False
+    elif not celebrity and (stats.followers_count
+                            >= settings.FEED_CELEBRITY_THRESHOLD):
+        celebrity = True
+    if celebrity != stats.celebrity:
+        AuthorStats.objects.filter(pk=stats.pk).update(celebrity=celebrity)
+    if celebrity:
+        TimelineEntry.objects.filter(author=author_id).delete()
+        return
+    if not stats.celebrity:
+        return
+    posts = list(Post.objects.filter(
+        author=author_id
+    ).values_list('id', 'pub_date'))
+    if not posts:
+        return
+    followers = Follow.objects.filter(
+        author=author_id
+    ).values_list('user_id', flat=True)
+    for user_id in followers.iterator():
+        _push(user_id, author_id, posts)
+
+
+def rebalance_candidates():
+    """
+    Авторы, которых может переключить rebalance: все «звёзды»
+    и не-«звёзды», набравшие порог (например, после его смены).
+    """
+    return AuthorStats.objects.filter(
+        Q(celebrity=True)
+        | Q(followers_count__gte=settings.FEED_CELEBRITY_THRESHOLD)
+    ).values_list('author', flat=True)
+
+
+def timeline(user):
+    """
+    Лента подписок: материализованные записи плюс посты «звёзд»,
+    подтянутые при чтении.
+    """
+    pulled = celebrities(user)
+    if not pulled:
+        return Post.objects.select_related('author', 'group').filter(
+            timeline_entries__user=user
+        ).order_by('-timeline_entries__pub_date',
+                   F('timeline_entries__post').desc())
+    pushed = TimelineEntry.objects.filter(user=user).values('post')
+    return Post.objects.select_related('author', 'group').filter(
+        Q(id__in=pushed) | Q(author__in=pulled)
+    ).order_by('-pub_date', '-id')
+
+
+def author_streams(user):
+    """
+    По одному потоку постов на каждого автора из подписок пользователя
+    для слияния в MergePaginator.
+    """
+    authors = Follow.objects.filter(
+        user=user
+    ).values_list('author', flat=True)
+    posts = Post.objects.select_related('author', 'group')
+    return [posts.filter(author=author_id) for author_id in authors]
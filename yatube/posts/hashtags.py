@@ -0,0 +1,74 @@
+import re
+
+from django.db.models import F
+
+from .models import Post, PostTag, Tag
+
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+HASHTAG = re.compile(r'(?<![\w&#])#(\w+)')
+
+
+def extract_tags(text):
+    """
+    Имена хэштегов из текста в порядке появления, без повторов
+    и в нижнем регистре. Слишком длинные теги пропускаются.
+    """
+    names = []
+    for name in HASHTAG.findall(text):
+        name = name.lower()
+        if len(name) <= TAG_MAX_LENGTH and name not in names:
+            names.append(name)
+    return names
+
+
+def sync_tags(post):
+    """
+    Приводит связи поста с хэштегами в соответствие с его текстом
+    и поправляет счётчики постов у добавленных и убранных тегов.
+    """
+    names = extract_tags(post.text)
+    current = dict(
+        PostTag.objects.filter(post=post).values_list('tag__name', 'tag')
+    )
+    added = [name for name in names if name not in current]
+    removed = [tag_id for name, tag_id in current.items()
+               if name not in names]
+    if removed:
+        PostTag.objects.filter(post=post, tag__in=removed).delete()
+        Tag.change_posts_count(removed, -1)
+    if added:
+        Tag.objects.bulk_create([Tag(name=name) for name in added],
+                                ignore_conflicts=True)
+        tags = Tag.objects.filter(name__in=added).values_list(
+            'id', flat=True
+        )
+        # Связь могла успеть появиться из параллельного сохранения:
+        # считаются только созданные здесь.
+        created = [
+            tag_id for tag_id in tags
+            if PostTag.objects.get_or_create(
+                post=post, tag_id=tag_id,
+                defaults={'pub_date': post.pub_date}
+            )[1]
+        ]
+        Tag.change_posts_count(created, 1)
+
+
+def untag(post):
+    """Уменьшает счётчики тегов удаляемого поста."""
+    Tag.change_posts_count(
+        PostTag.objects.filter(post=post).values('tag'), -1
+    )
+
+
+def tag_posts(tag):
+    """
+    Посты с хэштегом в порядке публикации. Ключ пагинации берётся
+    из таблицы связей, поэтому страница читается по её индексу.
+    """
+    return Post.objects.select_related('author', 'group').filter(
+        post_tags__tag=tag
+    ).annotate(
+        tagged=F('post_tags__pub_date'),
+        tagged_post=F('post_tags__post')
+    )
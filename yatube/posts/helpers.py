@@ -1,13 +1,336 @@
-from django.core.paginator import Paginator
+import base64
+import heapq
+import json
+from hashlib import md5
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .caching import FEED_COUNT_KEY, get_version
+from .search import build_query, search_posts
 
 LIMIT = 10
+COMMENTS_LIMIT = 20
+CURSOR_PARAM = 'cursor'
+NEXT, PREVIOUS = 'n', 'p'
+SNAPSHOT_KEY = 'search_snapshot:{}'
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Постраничный пагинатор, который берёт число объектов ленты
+    из кэша. Ключ сбрасывается сигналами при записи в ленту.
+    """
+    def __init__(self, object_list, per_page, feed):
+        super().__init__(object_list, per_page)
+        self.feed = feed
+
+    @cached_property
+    def count(self):
+        key = FEED_COUNT_KEY.format(self.feed)
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, settings.FEED_COUNT_CACHE_TIMEOUT)
+        return count
+
+
+def page_window(number, num_pages, on_each_side=2, on_ends=1):
+    """
+    Номера страниц вокруг текущей и по краям; None — пропуск.
+    """
+    if num_pages <= (on_each_side + on_ends) * 2 + 1:
+        return list(range(1, num_pages + 1))
+    pages = set(range(1, on_ends + 1))
+    pages.update(range(num_pages - on_ends + 1, num_pages + 1))
+    pages.update(range(max(number - on_each_side, 1),
+                       min(number + on_each_side, num_pages) + 1))
+    window = []
+    for page in sorted(pages):
+        if window and page - window[-1] > 1:
+            window.append(None)
+        window.append(page)
+    return window
+
+
+class CursorPage(Page):
+    """
+    Страница пагинатора по ключу: знает только соседние курсоры,
+    но не номер страницы и не общее число объектов.
+    """
+    def __init__(self, object_list, paginator, cursor='',
+                 next_cursor=None, previous_cursor=None):
+        super().__init__(object_list, None, paginator)
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<Page {self.cursor or "first"}>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator(Paginator):
+    """
+    Пагинатор по ключу (по умолчанию (pub_date, id)).
+    Вместо COUNT(*) и OFFSET делает один запрос с условием на ключ
+    последнего показанного объекта, поэтому стоимость страницы
+    не зависит от её глубины.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        # Порядок задаёт ключ пагинации, а не переданный queryset.
+        super().__init__(object_list.order_by(*ordering), per_page)
+        self.ordering = ordering
+        self.model = object_list.model
+
+    def encode_cursor(self, obj, direction):
+        values = [getattr(obj, name.lstrip('-')) for name in self.ordering]
+        values = [value if isinstance(value, (int, float)) else str(value)
+                  for value in values]
+        raw = json.dumps([direction] + values).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, *values = json.loads(raw)
+        except (ValueError, TypeError):
+            raise ValueError('Некорректный курсор')
+        if direction not in (NEXT, PREVIOUS):
+            raise ValueError('Некорректный курсор')
+        if len(values) != len(self.ordering):
+            raise ValueError('Некорректный курсор')
+        try:
+            values = [self._to_python(name.lstrip('-'), value)
+                      for name, value in zip(self.ordering, values)]
+        except Exception:
+            raise ValueError('Некорректный курсор')
+        return direction, values
+
+    def _to_python(self, name, value):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Ключом может быть аннотация: релевантность поиска
+            # или поле из присоединённой таблицы.
+            field = self.object_list.query.annotations[name].output_field
+        return field.to_python(value)
+
+    def _seek(self, values, reverse):
+        """Условие «строго после ключа values» в порядке ordering."""
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            lookup = f'{field}__lt' if descending else f'{field}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[field] = value
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else f'-{name}'
+                for name in self.ordering]
+
+    def fetch(self, condition, reverse, limit):
+        """Первые limit объектов после курсора в порядке обхода."""
+        ordering = self._reversed_ordering() if reverse else self.ordering
+        return list(
+            self.object_list.filter(condition).order_by(*ordering)[:limit]
+        )
+
+    def page(self, cursor=''):
+        direction = NEXT
+        condition = Q()
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+            condition = self._seek(values, direction == PREVIOUS)
+        objects = self.fetch(condition, direction == PREVIOUS,
+                             self.per_page + 1)
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if direction == PREVIOUS:
+            objects.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+        next_cursor = previous_cursor = None
+        if objects and has_next:
+            next_cursor = self.encode_cursor(objects[-1], NEXT)
+        if objects and has_previous:
+            previous_cursor = self.encode_cursor(objects[0], PREVIOUS)
+        return CursorPage(objects, self, cursor, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=''):
+        try:
+            return self.page(cursor or '')
+        except ValueError:
+            return self.page()
 
 
-def paginate(request, posts):
+class MergePaginator(CursorPaginator):
+    """
+    Пагинатор по ключу над несколькими упорядоченными потоками
+    (например, постами каждого автора из подписок). Из каждого потока
+    берётся не больше одной страницы по индексу, потоки сливаются кучей,
+    и слияние останавливается, как только страница заполнена.
+    Все поля ordering должны сортироваться в одном направлении.
+    """
+    def __init__(self, streams, per_page, model,
+                 ordering=('-pub_date', '-id')):
+        Paginator.__init__(self, streams, per_page)
+        self.ordering = ordering
+        self.model = model
+
+    def _check_object_list_is_ordered(self):
+        pass
+
+    def fetch(self, condition, reverse, limit):
+        ordering = self._reversed_ordering() if reverse else self.ordering
+        fields = [name.lstrip('-') for name in self.ordering]
+        streams = [
+            stream.filter(condition).order_by(*ordering)[:limit]
+            for stream in self.object_list
+        ]
+        merged = heapq.merge(
+            *streams,
+            key=lambda obj: [getattr(obj, name) for name in fields],
+            reverse=ordering[0].startswith('-')
+        )
+        return list(islice(merged, limit))
+
+
+class SnapshotPaginator(CursorPaginator):
+    """
+    Пагинатор по ключу для выдачи, порядок которой меняется со временем
+    (релевантность зависит от всего корпуса). Первая страница сохраняет
+    в кэш упорядоченные id первых SEARCH_SNAPSHOT_SIZE объектов,
+    а курсор хранит ключ этого снимка и смещение в нём, поэтому
+    листание не пропускает и не повторяет объекты. Ключ снимка
+    зависит от name (например, запроса) и версии страниц 'pages',
+    так что повторные запросы первой страницы берут готовый снимок.
+    """
+    def __init__(self, object_list, per_page, name, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.name = name
+
+    def encode_cursor(self, token, offset):
+        raw = json.dumps([token, offset]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            token, offset = json.loads(raw)
+        except (ValueError, TypeError):
+            raise ValueError('Некорректный курсор')
+        if not isinstance(token, str) or not isinstance(offset, int):
+            raise ValueError('Некорректный курсор')
+        ids = cache.get(SNAPSHOT_KEY.format(token))
+        if ids is None or not 0 <= offset < len(ids):
+            raise ValueError('Снимок выдачи устарел')
+        return token, offset, ids
+
+    def snapshot(self):
+        marker = f"{get_version('pages')}:{self.name}"
+        token = md5(marker.encode()).hexdigest()
+        key = SNAPSHOT_KEY.format(token)
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(self.object_list.values_list('pk', flat=True)[
+                :settings.SEARCH_SNAPSHOT_SIZE
+            ])
+            cache.set(key, ids, settings.SEARCH_SNAPSHOT_TIMEOUT)
+        return token, ids
+
+    def page(self, cursor=''):
+        if cursor:
+            token, offset, ids = self.decode_cursor(cursor)
+        else:
+            (token, ids), offset = self.snapshot(), 0
+        chunk = ids[offset:offset + self.per_page]
+        found = self.object_list.in_bulk(chunk)
+        # Удалённые и изменённые после снимка посты просто пропадают.
+        objects = [found[pk] for pk in chunk if pk in found]
+        next_cursor = previous_cursor = None
+        if offset + self.per_page < len(ids):
+            next_cursor = self.encode_cursor(token, offset + self.per_page)
+        if offset:
+            previous_cursor = self.encode_cursor(
+                token, max(offset - self.per_page, 0)
+            )
+        return CursorPage(objects, self, cursor, next_cursor, previous_cursor)
+
+
+def paginate(request, posts, mode=None, feed=None):
     """
     Функция пагинации.
+    Режим 'offset' — постраничная навигация по номерам,
+    режим 'cursor' — навигация «новее/старше» по ключу (pub_date, id).
+    Если указано имя ленты feed, число постов берётся из кэша.
     """
-    paginator = Paginator(posts, LIMIT)
+    if mode is None:
+        if CURSOR_PARAM in request.GET:
+            mode = 'cursor'
+        else:
+            mode = settings.POSTS_PAGINATION
+    if mode == 'cursor':
+        paginator = CursorPaginator(posts, LIMIT)
+        return paginator.get_page(request.GET.get(CURSOR_PARAM))
+    if feed is None:
+        paginator = Paginator(posts, LIMIT)
+    else:
+        paginator = CachedCountPaginator(posts, LIMIT, feed)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
+
+
+def paginate_merged(request, streams, model):
+    """
+    Функция пагинации по ключу для слияния нескольких потоков.
+    """
+    paginator = MergePaginator(streams, LIMIT, model)
+    return paginator.get_page(request.GET.get(CURSOR_PARAM))
+
+
+def paginate_comments(request, comments):
+    """
+    Функция пагинации комментариев по ключу (created, id):
+    от старых к новым, следующая порция — по курсору.
+    """
+    paginator = CursorPaginator(comments, COMMENTS_LIMIT,
+                                ordering=('created', 'id'))
+    return paginator.get_page(request.GET.get(CURSOR_PARAM))
+
+
+def paginate_tag(request, posts):
+    """
+    Функция пагинации ленты хэштега по ключу из таблицы связей.
+    """
+    paginator = CursorPaginator(posts, LIMIT,
+                                ordering=('-tagged', '-tagged_post'))
+    return paginator.get_page(request.GET.get(CURSOR_PARAM))
+
+
+def paginate_search(request, text, posts):
+    """
+    Функция пагинации результатов поиска по снимку выдачи
+    в порядке (rank, id): сначала самые релевантные.
+    """
+    paginator = SnapshotPaginator(search_posts(text, posts), LIMIT,
+                                  build_query(text).lower(),
+                                  ordering=('rank', '-id'))
+    return paginator.get_page(request.GET.get(CURSOR_PARAM))
@@ -0,0 +1,108 @@
+import base64
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+PLACEHOLDER_SIZE = (16, 16)
+ORIENTATION = 0x0112
+# Значения EXIF-ориентации, при которых картинка поворачивается на 90°.
+TRANSPOSED = (5, 6, 7, 8)
+# Режимы, в которых ICC-профиль остаётся верным после пересохранения.
+ICC_MODES = ('RGB', 'RGBA', 'L')
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def ingest(upload):
+    """
+    Нормализует загруженную картинку поста: уменьшает до
+    POST_IMAGE_MAX_SIZE, поворачивает по EXIF и пересохраняет без
+    метаданных в прогрессивный JPEG (или в PNG, если есть прозрачность).
+    Большие JPEG декодируются сразу в уменьшенном масштабе через draft(),
+    остальные форматы уменьшаются через reduce(), поэтому память
+    не зависит от размера исходного снимка.
+    Анимированные картинки сохраняются как есть. ICC-профиль
+    сохраняется только для RGB и оттенков серого, иначе он не
+    соответствует пересохранённым пикселям.
+    """
+    try:
+        upload.seek(0)
+        image = Image.open(upload)
+        if getattr(image, 'is_animated', False):
+            upload.seek(0)
+            return upload
+        mode = image.mode
+        icc_profile = image.info.get('icc_profile')
+        max_size = settings.POST_IMAGE_MAX_SIZE
+        image.draft('RGB', max_size)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.LANCZOS, reducing_gap=3.0)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Не удалось прочитать изображение.',
+                              code='invalid_image')
+    params = {'optimize': True}
+    if icc_profile and mode in ICC_MODES:
+        params['icc_profile'] = icc_profile
+    if has_alpha(image):
+        image = image.convert('RGBA')
+        format_, extension = 'PNG', 'png'
+    else:
+        if image.mode != 'L':
+            image = image.convert('RGB')
+        format_, extension = 'JPEG', 'jpg'
+        params.update(quality=settings.POST_IMAGE_QUALITY,
+                      progressive=True)
+    buffer = BytesIO()
+    image.save(buffer, format_, **params)
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    return ContentFile(buffer.getvalue(), name=f'{name}.{extension}')
+
+
+def placeholder(image):
+    """Крошечная копия картинки в виде data URI для размытой заглушки."""
+    image = image.copy()
+    image.thumbnail(PLACEHOLDER_SIZE, reducing_gap=2.0)
+    buffer = BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=40, optimize=True)
+    data = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/jpeg;base64,{data}'
+
+
+def measure(post):
+    """
+    Записывает в пост размеры его картинки и заглушку. Картинка
+    декодируется в уменьшенном масштабе; размеры берутся из заголовка.
+    Если файл не читается, поля очищаются.
+    """
+    post.image_width = post.image_height = None
+    post.image_placeholder = ''
+    if not post.image:
+        return
+    try:
+        post.image.open()
+        with Image.open(post.image) as source:
+            width, height = source.size
+            if source.getexif().get(ORIENTATION) in TRANSPOSED:
+                width, height = height, width
+            source.draft('RGB', (PLACEHOLDER_SIZE[0] * 8,
+                                 PLACEHOLDER_SIZE[1] * 8))
+            post.image_placeholder = placeholder(
+                ImageOps.exif_transpose(source)
+            )
+            post.image_width, post.image_height = width, height
+    except (OSError, SuspiciousFileOperation):
+        return
+    finally:
+        # Новый файл ещё будет сохранён из этого же объекта.
+        if post.image._committed:
+            post.image.close()
+        elif not post.image.closed:
+            post.image.seek(0)
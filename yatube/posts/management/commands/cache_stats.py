@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts.caching import OUTCOMES, stats
+
+NAMES = ('index', 'group_list', 'profile', 'post_detail', 'index_page')
+
+
+class Command(BaseCommand):
+    """
+    Показывает, как часто кэш страниц и фрагментов отдавал свежее,
+    устаревшее или перерисованное значение.
+    """
+    help = 'Выводит счётчики путей кэша страниц и фрагментов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', default=NAMES)
+
+    def handle(self, *args, **options):
+        self.stdout.write('\t'.join(('name', *OUTCOMES)))
+        for name, counts in stats(options['names']).items():
+            self.stdout.write('\t'.join(
+                (name, *(str(counts[outcome]) for outcome in OUTCOMES))
+            ))
@@ -0,0 +1,61 @@
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+
+from posts.feeds import author_streams, timeline
+from posts.helpers import LIMIT, CursorPaginator, MergePaginator
+from posts.models import Post
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает способы построения ленты подписок для пользователя.
+    """
+    help = 'Замеряет время построения страниц ленты подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--pages', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('Пользователь не найден')
+        pages = options['pages']
+        strategies = {
+            'join': lambda: self.walk_offset(
+                Post.objects.filter(author__following__user=user), pages),
+            'timeline': lambda: self.walk_cursor(
+                CursorPaginator(timeline(user), LIMIT), pages),
+            'merge': lambda: self.walk_cursor(
+                MergePaginator(author_streams(user), LIMIT, Post), pages),
+        }
+        for name, walk in strategies.items():
+            started = perf_counter()
+            for _ in range(options['repeat']):
+                walk()
+            elapsed = (perf_counter() - started) / options['repeat']
+            self.stdout.write(
+                f'{name}: {elapsed * 1000 / pages:.2f} мс на страницу'
+            )
+
+    def walk_offset(self, posts, pages):
+        paginator = Paginator(posts, LIMIT)
+        for number in range(1, pages + 1):
+            page = paginator.get_page(number)
+            list(page)
+            if not page.has_next():
+                break
+
+    def walk_cursor(self, paginator, pages):
+        page = paginator.get_page()
+        for _ in range(pages - 1):
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_cursor)
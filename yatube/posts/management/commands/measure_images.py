@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import measure
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    """
+    Считает размеры и заглушки картинок постов, загруженных раньше.
+    """
+    help = 'Заполняет размеры и заглушки картинок постов, где их нет.'
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').filter(
+            image_placeholder=''
+        ).only('id', 'image')
+        measured = 0
+        for post in posts.iterator():
+            measure(post)
+            if not post.image_placeholder:
+                continue
+            Post.objects.filter(pk=post.pk).update(
+                image_width=post.image_width,
+                image_height=post.image_height,
+                image_placeholder=post.image_placeholder
+            )
+            measured += 1
+        self.stdout.write(f'Обработано картинок: {measured}')
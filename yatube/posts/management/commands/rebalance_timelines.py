@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.feeds import rebalance, rebalance_candidates
+
+
+class Command(BaseCommand):
+    """
+    Переключает авторов по порогам «звёзд» и выравнивает их ленты.
+    Запускается периодически и после смены FEED_CELEBRITY_THRESHOLD.
+    """
+    help = 'Раскладывает или убирает посты авторов по порогу «звёзд».'
+
+    def handle(self, *args, **options):
+        count = 0
+        for author_id in rebalance_candidates().iterator():
+            rebalance(author_id)
+            count += 1
+        self.stdout.write(f'Обработано авторов: {count}')
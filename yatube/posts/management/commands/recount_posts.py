@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import AuthorStats, Follow, Post
+
+
+def count_by_author(queryset):
+    return dict(
+        queryset.order_by().values_list('author').annotate(total=Count('id'))
+    )
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает счётчики постов и подписчиков авторов по таблицам
+    постов и подписок.
+    """
+    help = 'Восстанавливает счётчики AuthorStats по постам и подпискам.'
+
+    def handle(self, *args, **options):
+        posts = count_by_author(Post.objects.all())
+        followers = count_by_author(Follow.objects.all())
+        fixed = 0
+        with transaction.atomic():
+            for stats in AuthorStats.objects.select_for_update():
+                actual = (posts.pop(stats.author_id, 0),
+                          followers.pop(stats.author_id, 0))
+                if (stats.posts_count, stats.followers_count) != actual:
+                    stats.posts_count, stats.followers_count = actual
+                    stats.save(update_fields=['posts_count',
+                                              'followers_count'])
+                    fixed += 1
+            missing = posts.keys() | followers.keys()
+            AuthorStats.objects.bulk_create(
+                [AuthorStats(author_id=author_id,
+                             posts_count=posts.get(author_id, 0),
+                             followers_count=followers.get(author_id, 0))
+                 for author_id in missing]
+            )
+        self.stdout.write(
+            f'Исправлено счётчиков: {fixed}, создано: {len(missing)}'
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import PostTag, Tag
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает счётчики постов хэштегов по таблице связей.
+    """
+    help = 'Восстанавливает Tag.posts_count по связям постов с тегами.'
+
+    def handle(self, *args, **options):
+        counts = dict(
+            PostTag.objects.order_by().values_list('tag').annotate(
+                total=Count('id')
+            )
+        )
+        fixed = 0
+        with transaction.atomic():
+            for tag in Tag.objects.select_for_update():
+                actual = counts.get(tag.id, 0)
+                if tag.posts_count != actual:
+                    tag.posts_count = actual
+                    tag.save(update_fields=['posts_count'])
+                    fixed += 1
+        self.stdout.write(f'Исправлено счётчиков: {fixed}')
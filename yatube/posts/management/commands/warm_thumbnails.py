@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate, get_executor
+
+
+class Command(BaseCommand):
+    """
+    Строит миниатюры для всех картинок постов.
+    """
+    help = 'Заполняет хранилище миниатюр для уже загруженных картинок.'
+
+    def handle(self, *args, **options):
+        names = set(
+            Post.objects.exclude(image='').values_list('image', flat=True)
+        )
+        executor = get_executor()
+        for _ in (executor.map if executor else map)(generate, names):
+            pass
+        self.stdout.write(f'Обработано картинок: {len(names)}')
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_posts(apps, schema_editor):
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    Post = apps.get_model('posts', 'Post')
+    counts = Post.objects.order_by().values('author').annotate(
+        total=models.Count('id')
+    )
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(author_id=row['author'], posts_count=row['total'])
+         for row in counts]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0012_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(count_posts, migrations.RunPython.noop),
+    ]
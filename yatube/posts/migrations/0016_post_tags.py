@@ -0,0 +1,78 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:42
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Разбор хэштегов скопирован из posts/hashtags.py на момент миграции,
+# чтобы она не зависела от текущего кода приложения.
+HASHTAG = re.compile(r'(?<![\w&#])#(\w+)')
+TAG_MAX_LENGTH = 64
+
+
+def extract_tags(text):
+    names = []
+    for name in HASHTAG.findall(text):
+        name = name.lower()
+        if len(name) <= TAG_MAX_LENGTH and name not in names:
+            names.append(name)
+    return names
+
+
+def fill_tags(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Tag = apps.get_model('posts', 'Tag')
+    PostTag = apps.get_model('posts', 'PostTag')
+    tagged = {}
+    for post_id, text, pub_date in Post.objects.values_list(
+            'id', 'text', 'pub_date').iterator():
+        for name in extract_tags(text):
+            tagged.setdefault(name, []).append((post_id, pub_date))
+    Tag.objects.bulk_create(
+        [Tag(name=name, posts_count=len(posts))
+         for name, posts in tagged.items()]
+    )
+    tags = dict(Tag.objects.values_list('name', 'id'))
+    PostTag.objects.bulk_create(
+        [PostTag(post_id=post_id, tag_id=tags[name], pub_date=pub_date)
+         for name, posts in tagged.items()
+         for post_id, pub_date in posts],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='posts.Post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='posts.Tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['tag', 'pub_date', 'post'], name='post_tag_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='posttag',
+            constraint=models.UniqueConstraint(fields=('tag', 'post'), name='tag_post_unique'),
+        ),
+        migrations.RunPython(fill_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 2.2.16 on 2026-10-17 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_followers(apps, schema_editor):
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    counts = dict(
+        Follow.objects.order_by().values_list('author').annotate(
+            total=models.Count('id')
+        )
+    )
+    for stats in AuthorStats.objects.all():
+        stats.followers_count = counts.pop(stats.author_id, 0)
+        stats.celebrity = (
+            stats.followers_count >= settings.FEED_CELEBRITY_THRESHOLD
+        )
+        stats.save(update_fields=['followers_count', 'celebrity'])
+    posts = dict(
+        Post.objects.order_by().values_list('author').annotate(
+            total=models.Count('id')
+        )
+    )
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(author_id=author_id,
+                     posts_count=posts.get(author_id, 0),
+                     followers_count=total,
+                     celebrity=total >= settings.FEED_CELEBRITY_THRESHOLD)
+         for author_id, total in counts.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='celebrity',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='authorstats',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_followers, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -25,15 +28,32 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False)
 
     class Meta:
         ordering = ['-pub_date', ]
+        indexes = [
+            models.Index(fields=['pub_date'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', 'pub_date'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', 'pub_date'],
+                         name='post_group_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        # Счётчики и ленты обновляются в post_save той же транзакцией.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Group(models.Model):
     """Модель для хранения групп."""
@@ -60,6 +80,12 @@ class Comment(models.Model):
                             help_text='Текст нового комментария')
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
+
 
 class Follow(models.Model):
     """Модель для хранения подписок."""
@@ -75,3 +101,185 @@ class Follow(models.Model):
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='user_author_unique')
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Модель для хранения материализованной ленты подписок."""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name='+')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date', ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='user_post_unique')
+        ]
+        indexes = [
+            models.Index(fields=['user', 'pub_date', 'post'],
+                         name='timeline_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """Модель для хранения счётчиков автора."""
+    author = models.OneToOneField(User,
+                                  on_delete=models.CASCADE,
+                                  related_name='stats')
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    # Посты «звезды» не раскладываются по лентам, а подтягиваются
+    # при чтении; флаг переключает posts.feeds.
+    celebrity = models.BooleanField(default=False)
+
+    @classmethod
+    def for_author(cls, author_id):
+        """
+        Счётчики автора; при отсутствии пересчитываются по постам
+        и подпискам.
+        """
+        stats, _ = cls.objects.get_or_create(
+            author_id=author_id,
+            defaults={
+                'posts_count': Post.objects.filter(author=author_id).count(),
+                'followers_count': Follow.objects.filter(
+                    author=author_id
+                ).count(),
+            }
+        )
+        return stats
+
+    @classmethod
+    def change_posts_count(cls, author_id, delta):
+        """
+        Атомарно меняет счётчик, не опуская его ниже нуля, даже если
+        он разошёлся с постами. Отсутствующая запись создаётся только
+        при добавлении поста: при удалении автора вместе с постами
+        её некому и незачем создавать.
+        """
+        updated = cls.objects.filter(author=author_id).update(
+            posts_count=Greatest(models.F('posts_count') + delta, 0)
+        )
+        if not updated and delta > 0:
+            cls.for_author(author_id)
+
+    @classmethod
+    def change_followers_count(cls, author_id, delta):
+        """Атомарно меняет число подписчиков, как change_posts_count."""
+        updated = cls.objects.filter(author=author_id).update(
+            followers_count=Greatest(models.F('followers_count') + delta, 0)
+        )
+        if not updated and delta > 0:
+            cls.for_author(author_id)
+
+
+class MediaFile(models.Model):
+    """Модель для хранения числа постов, ссылающихся на файл картинки."""
+    name = models.CharField(max_length=255, unique=True)
+    refs = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def retain(cls, name):
+        """Добавляет ссылку на файл."""
+        updated = cls.objects.filter(name=name).update(
+            refs=models.F('refs') + 1
+        )
+        if not updated:
+            _, created = cls.objects.get_or_create(name=name,
+                                                   defaults={'refs': 1})
+            if not created:
+                cls.retain(name)
+
+    @classmethod
+    def release(cls, name):
+        """
+        Убирает ссылку на файл. Возвращает True, если ссылок
+        не осталось и файл можно удалять.
+        """
+        cls.objects.filter(name=name, refs__gt=0).update(
+            refs=models.F('refs') - 1
+        )
+        deleted, _ = cls.objects.filter(name=name, refs=0).delete()
+        return bool(deleted)
+
+
+class Tag(models.Model):
+    """Модель для хранения хэштегов."""
+    name = models.CharField(max_length=64, unique=True)
+    posts_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'#{self.name}'
+
+    @classmethod
+    def change_posts_count(cls, tags, delta):
+        """
+        Атомарно меняет счётчики тегов, не опуская их ниже нуля,
+        как AuthorStats.change_posts_count.
+        """
+        cls.objects.filter(id__in=tags).update(
+            posts_count=Greatest(models.F('posts_count') + delta, 0)
+        )
+
+
+class PostTag(models.Model):
+    """Модель для хранения связей постов с хэштегами."""
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='post_tags')
+    tag = models.ForeignKey(Tag,
+                            on_delete=models.CASCADE,
+                            related_name='post_tags')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'post'],
+                                    name='tag_post_unique')
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'pub_date', 'post'],
+                         name='post_tag_pub_date_idx'),
+        ]
+
+
+class SearchField(models.TextField):
+    """Колонка полнотекстового индекса FTS5."""
+
+
+@SearchField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class PostSearch(models.Model):
+    """Полнотекстовый индекс постов (виртуальная таблица FTS5)."""
+    post = models.OneToOneField(Post,
+                                on_delete=models.DO_NOTHING,
+                                primary_key=True,
+                                db_column='rowid',
+                                related_name='search_entry')
+    text = SearchField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'posts_post_fts'
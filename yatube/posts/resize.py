@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from PIL import Image, ImageOps
+
+from .images import has_alpha
+from .models import Post
+
+SALT = 'posts.resize'
+SIGNATURE_PARAM = 's'
+SHARDS = 256
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+
+def signature(width, height, name):
+    value = f'{width}x{height}/{name}'
+    return salted_hmac(SALT, value).hexdigest()[:20]
+
+
+def resized_url(name, width, height):
+    """Подписанная ссылка на картинку, уменьшенную до width x height."""
+    url = reverse('posts:resized_image', kwargs={
+        'width': width, 'height': height, 'name': name,
+    })
+    return f'{url}?{SIGNATURE_PARAM}={signature(width, height, name)}'
+
+
+def is_allowed(width, height, name, sign):
+    """Размер не больше предельного и подпись сделана нашим ключом."""
+    max_width, max_height = settings.RESIZE_MAX_SIZE
+    if not (0 < width <= max_width and 0 < height <= max_height):
+        return False
+    return constant_time_compare(sign or '',
+                                 signature(width, height, name))
+
+
+def cache_key(width, height, name):
+    return hashlib.sha1(f'{width}x{height}/{name}'.encode()).hexdigest()
+
+
+def cache_path(key):
+    """Файл в кэше: шард по первым двум символам ключа."""
+    return os.path.join(settings.RESIZE_CACHE_ROOT, key[:2], key)
+
+
+def resize(name, width, height):
+    """
+    Уменьшает картинку поста, чтобы она вписалась в width x height.
+    Возвращает содержимое и формат результата.
+    """
+    storage = Post._meta.get_field('image').storage
+    with storage.open(name) as file_, Image.open(file_) as image:
+        image.draft('RGB', (width, height))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, height), Image.LANCZOS, reducing_gap=3.0)
+        buffer = BytesIO()
+        if has_alpha(image):
+            format_ = 'PNG'
+            image.convert('RGBA').save(buffer, format_, optimize=True)
+        else:
+            format_ = 'JPEG'
+            image.convert('RGB').save(buffer, format_, optimize=True,
+                                      quality=settings.POST_IMAGE_QUALITY,
+                                      progressive=True)
+    return buffer.getvalue(), format_
+
+
+def store(key, data, format_):
+    """
+    Записывает результат в шард атомарной заменой файла и вытесняет
+    из шарда давно не читанные файлы сверх его доли лимита.
+    Возвращает открытый файл результата.
+    """
+    path = cache_path(key) + '.' + format_.lower()
+    shard = os.path.dirname(path)
+    os.makedirs(shard, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=shard, suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as temp:
+        temp.write(data)
+    os.replace(temp_path, path)
+    file_ = open(path, 'rb')
+    evict(shard, settings.RESIZE_CACHE_MAX_BYTES // SHARDS, keep=path)
+    return file_
+
+
+def evict(shard, limit, keep=None):
+    """Удаляет из шарда файлы с самым старым временем чтения."""
+    entries = []
+    with os.scandir(shard) as files:
+        for entry in files:
+            if entry.name.endswith('.tmp') or entry.path == keep:
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if keep is not None:
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def lookup(key):
+    """
+    Открытый файл из кэша и его формат. Время изменения файла служит
+    отметкой последнего чтения для LRU; открытый файл можно дочитать,
+    даже если его тут же вытеснят.
+    """
+    for format_ in CONTENT_TYPES:
+        path = cache_path(key) + '.' + format_.lower()
+        try:
+            file_ = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+        os.utime(file_.fileno())
+        return file_, format_
+    return None, None
+
+
+def get_or_create(name, width, height):
+    """
+    Открытый файл уменьшенной картинки и её тип; при промахе
+    картинка уменьшается и кладётся в кэш.
+    """
+    key = cache_key(width, height, name)
+    file_, format_ = lookup(key)
+    if file_ is None:
+        data, format_ = resize(name, width, height)
+        file_ = store(key, data, format_)
+    return file_, CONTENT_TYPES[format_]
@@ -0,0 +1,71 @@
+import re
+
+from django.db.models import F
+
+FTS_TABLE = 'posts_post_fts'
+
+CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+    f"USING fts5(text, content='posts_post', content_rowid='id')"
+)
+REBUILD = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')"
+TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai
+        AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad
+        AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END''',
+)
+
+WORD = re.compile(r'\w+')
+
+
+def install_triggers(connection):
+    """
+    Создаёт триггеры, синхронизирующие индекс с таблицей постов.
+    SQLite удаляет триггеры, когда миграции пересоздают таблицу постов,
+    поэтому функция вызывается и после каждого migrate.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    if FTS_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for trigger in TRIGGERS:
+            cursor.execute(trigger)
+
+
+def build_query(text):
+    """
+    Превращает пользовательский ввод в запрос FTS5: все слова
+    обязательны, последнее ищется по префиксу.
+    """
+    words = WORD.findall(text)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_posts(text, posts):
+    """
+    Посты, подходящие под запрос, с релевантностью rank
+    (чем меньше, тем выше в выдаче).
+    """
+    query = build_query(text)
+    if not query:
+        return posts.none()
+    return posts.filter(search_entry__text__match=query).annotate(
+        rank=F('search_entry__rank')
+    )
@@ -0,0 +1,165 @@
+from django.db import connections, transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import caching, feeds, hashtags, images, search, thumbnails
+from .models import AuthorStats, Comment, Follow, Group, MediaFile, Post
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    """Раскладывает новый пост по лентам подписчиков."""
+    if created:
+        feeds.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    """Заполняет ленту нового подписчика."""
+    if created:
+        feeds.followed(instance.author_id)
+        feeds.backfill(instance)
+        caching.invalidate_counts(f'follower:{instance.user_id}')
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Чистит ленту после отписки."""
+    feeds.unfollowed(instance.author_id)
+    feeds.prune(instance)
+    caching.invalidate_counts(f'follower:{instance.user_id}')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def feed_changed(sender, **kwargs):
+    """Сбрасывает кэш главной страницы после изменения постов и групп."""
+    caching.bump_version('index')
+    caching.bump_version('pages')
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comments_changed(sender, **kwargs):
+    """Сбрасывает кэш страниц после изменения комментариев."""
+    caching.bump_version('pages')
+
+
+@receiver(post_save, sender=Post)
+def post_counted(sender, instance, created, **kwargs):
+    """Увеличивает счётчик постов автора."""
+    if created:
+        AuthorStats.change_posts_count(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_uncounted(sender, instance, **kwargs):
+    """Уменьшает счётчик постов автора."""
+    AuthorStats.change_posts_count(instance.author_id, -1)
+
+
+@receiver(pre_save, sender=Post)
+def post_regrouped(sender, instance, **kwargs):
+    """Запоминает прежние группу и картинку редактируемого поста."""
+    if instance.pk:
+        previous = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image'
+        ).first() or (None, '')
+        instance.previous_group_id, instance.previous_image = previous
+
+
+@receiver(pre_save, sender=Post)
+def post_image_measured(sender, instance, **kwargs):
+    """Считает размеры и заглушку новой картинки поста."""
+    if instance.image.name != getattr(instance, 'previous_image', ''):
+        images.measure(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_feeds_changed(sender, instance, created, **kwargs):
+    """Сбрасывает число постов в лентах, куда попал пост."""
+    if created:
+        caching.invalidate_counts(
+            *caching.post_feeds(instance.author_id, instance.group_id)
+        )
+        feeds.invalidate_followers(instance.author_id)
+        return
+    previous_group_id = getattr(instance, 'previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        caching.invalidate_counts(f'group:{previous_group_id}',
+                                  f'group:{instance.group_id}')
+
+
+@receiver(post_delete, sender=Post)
+def post_feeds_shrunk(sender, instance, **kwargs):
+    """Сбрасывает число постов в лентах, откуда пропал пост."""
+    caching.invalidate_counts(
+        *caching.post_feeds(instance.author_id, instance.group_id)
+    )
+    feeds.invalidate_followers(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def post_tagged(sender, instance, **kwargs):
+    """Обновляет хэштеги поста по его тексту."""
+    hashtags.sync_tags(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def post_untagged(sender, instance, **kwargs):
+    """Уменьшает счётчики хэштегов удаляемого поста."""
+    hashtags.untag(instance)
+
+
+def release_image(name):
+    if name and MediaFile.release(name):
+        transaction.on_commit(lambda: thumbnails.delete_unreferenced(name))
+
+
+def stored_name(instance):
+    """Имя, под которым картинка поста ляжет в хранилище."""
+    image = instance.image
+    if image._committed:
+        return image.name
+    name = image.field.generate_filename(instance, image.name)
+    return image.storage.hashed_name(name, image.file)
+
+
+@receiver(pre_save, sender=Post)
+def post_image_retained(sender, instance, **kwargs):
+    """
+    Берёт ссылку на файл новой картинки до записи в хранилище.
+    Хранилище не пишет уже существующий файл, и без ссылки его могло
+    бы стереть удаление последнего поста с той же картинкой.
+    """
+    instance.retained_image = None
+    if (not instance.image
+            or instance.image.name == getattr(instance, 'previous_image',
+                                              '')):
+        return
+    instance.retained_image = stored_name(instance)
+    MediaFile.retain(instance.retained_image)
+
+
+@receiver(post_save, sender=Post)
+def post_image_referenced(sender, instance, created, **kwargs):
+    """Отпускает прежнюю картинку после замены или удаления."""
+    previous = '' if created else getattr(instance, 'previous_image', '')
+    if (instance.image.name == previous
+            and getattr(instance, 'retained_image', None) is None):
+        return
+    release_image(previous)
+
+
+@receiver(post_delete, sender=Post)
+def post_image_released(sender, instance, **kwargs):
+    """Удаляет ссылку на файл картинки удалённого поста."""
+    release_image(instance.image.name)
+
+
+def search_triggers_installed(sender, using, **kwargs):
+    """Восстанавливает триггеры поиска после миграций."""
+    search.install_triggers(connections[using])
@@ -0,0 +1,56 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from posts.caching import fetch
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, timeout, name, version, vary_on):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.version = version
+        self.vary_on = vary_on
+
+    def render(self, context):
+        try:
+            timeout = int(self.timeout.resolve(context))
+        except (ValueError, TypeError):
+            raise template.TemplateSyntaxError(
+                f'"fragment" tag got a non-integer timeout value: '
+                f'{self.timeout.var!r}'
+            )
+        key = make_template_fragment_key(
+            self.name, [var.resolve(context) for var in self.vary_on]
+        )
+        value, _ = fetch(key, self.version.resolve(context),
+                         lambda: self.nodelist.render(context),
+                         timeout, self.name)
+        return value
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    Как {% cache %}, но с версией и защитой от одновременной
+    перерисовки: пока один запрос перерисовывает устаревший фрагмент,
+    остальные получают прежний.
+
+    {% fragment timeout name version [vary_on ...] %} ... {% endfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 4:
+        raise template.TemplateSyntaxError(
+            f'"{bits[0]}" tag requires at least 3 arguments.'
+        )
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        bits[2],
+        parser.compile_filter(bits[3]),
+        [parser.compile_filter(bit) for bit in bits[4:]],
+    )
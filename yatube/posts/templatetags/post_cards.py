@@ -0,0 +1,41 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from posts.caching import card_key
+from posts.thumbnails import CARD_THUMBNAIL, prefetch_thumbnails
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts, show_link=False, show_group=False,
+               separator=False):
+    """
+    Собирает ленту из закэшированных карточек постов: все карточки
+    страницы читаются из кэша одним запросом, отрисовываются только
+    отсутствующие, а их миниатюры заранее выбираются пачкой.
+    С separator под ссылкой на группу выводится разделитель.
+    Возвращает список готовых карточек.
+    """
+    keys = [card_key(post, show_link, show_group, separator)
+            for post in posts]
+    cards = cache.get_many(keys)
+    missing = {key: post for key, post in zip(keys, posts)
+               if key not in cards}
+    if missing:
+        card = get_template(CARD_TEMPLATE).template
+        images = [post.image for post in missing.values()]
+        with prefetch_thumbnails(images, *CARD_THUMBNAIL), \
+                context.push(show_link=show_link, show_group=show_group,
+                             separator=separator):
+            for key, post in missing.items():
+                context['post'] = post
+                cards[key] = card.render(context)
+        cache.set_many({key: cards[key] for key in missing},
+                       settings.POST_CARD_CACHE_TIMEOUT)
+    return [mark_safe(cards[key]) for key in keys]
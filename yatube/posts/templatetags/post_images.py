@@ -0,0 +1,39 @@
+from django import template
+
+from posts.resize import resized_url
+from posts.thumbnails import stored_sources, thumbnail_size
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture_sources(image, geometry):
+    """
+    Источники <picture> для картинки поста: WebP и AVIF нескольких
+    ширин, заранее построенные пайплайном миниатюр.
+    """
+    if not image:
+        return []
+    return stored_sources(image, geometry)
+
+
+@register.simple_tag
+def image_size(post, geometry, thumbnail):
+    """
+    Ширина и высота для <img> из размеров, сохранённых в посте.
+    Для старых постов без размеров они берутся у самой миниатюры.
+    """
+    if post.image_width and post.image_height:
+        return thumbnail_size(post.image_width, post.image_height, geometry)
+    return thumbnail.width, thumbnail.height
+
+
+@register.simple_tag
+def resized(image, width, height):
+    """
+    Подписанная ссылка на картинку поста, уменьшенную по запросу
+    до width x height.
+    """
+    if not image:
+        return ''
+    return resized_url(image.name, width, height)
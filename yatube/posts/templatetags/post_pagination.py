@@ -0,0 +1,11 @@
+from django import template
+
+from ..helpers import page_window as window
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page_obj):
+    """Номера страниц для навигации вокруг текущей страницы."""
+    return window(page_obj.number, page_obj.paginator.num_pages)
@@ -1,13 +1,17 @@
 from datetime import datetime
+from io import BytesIO
 import shutil
 import tempfile
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
+from PIL import Image, JpegImagePlugin
 
+from posts.forms import PostForm
 from posts.models import Post, Group, Comment
 
 User = get_user_model()
@@ -139,3 +143,92 @@ class PostCreateFormTests(TestCase):
             text='Тестовый коммент от неавторизованного'
         )
         self.assertFalse(comment.exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POST_IMAGE_MAX_SIZE=(200, 200))
+class PostImageIngestTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, name, format_, mode='RGB', size=(600, 300), **params):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, format_, **params)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def clean_image(self, upload):
+        form = PostForm(data={'text': 'Картинка'}, files={'image': upload})
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.cleaned_data['image']
+
+    def test_photo_is_rotated_shrunk_and_stripped(self):
+        """Проверяем, что фото уменьшается, поворачивается по EXIF
+        и пересохраняется прогрессивным JPEG без метаданных.
+        """
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        image = self.clean_image(self.upload('photo.jpeg', 'JPEG',
+                                             exif=exif.tobytes()))
+        self.assertEqual(image.name, 'photo.jpg')
+        with Image.open(image) as saved:
+            self.assertEqual(saved.format, 'JPEG')
+            self.assertEqual(saved.size, (100, 200))
+            self.assertTrue(saved.info.get('progressive'))
+            self.assertNotIn('exif', saved.info)
+
+    def test_large_jpeg_is_decoded_by_draft(self):
+        """Проверяем, что большой JPEG декодируется в уменьшенном
+        масштабе, а не целиком.
+        """
+        upload = self.upload('big.jpg', 'JPEG', size=(1600, 1600))
+        jpeg = JpegImagePlugin.JpegImageFile
+        with mock.patch.object(jpeg, 'draft', autospec=True,
+                               side_effect=jpeg.draft) as draft:
+            image = self.clean_image(upload)
+        self.assertEqual(draft.call_args[0][1:], ('RGB', (200, 200)))
+        with Image.open(image) as saved:
+            self.assertEqual(saved.size, (200, 200))
+
+    def test_transparent_image_stays_png(self):
+        """Проверяем, что картинка с прозрачностью остаётся PNG."""
+        image = self.clean_image(self.upload('logo.gif', 'PNG', mode='RGBA'))
+        self.assertEqual(image.name, 'logo.png')
+        with Image.open(image) as saved:
+            self.assertEqual(saved.format, 'PNG')
+            self.assertEqual(saved.size, (200, 100))
+
+    def test_truncated_upload_is_rejected(self):
+        """Проверяем, что обрезанный JPEG даёт ошибку формы, а не 500."""
+        upload = self.upload('broken.jpg', 'JPEG', size=(1600, 1600))
+        upload = SimpleUploadedFile('broken.jpg', upload.read()[:2000])
+        form = PostForm(data={'text': 'Картинка'}, files={'image': upload})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    def test_icc_profile_kept_only_for_rgb(self):
+        """Проверяем, что ICC-профиль переносится только для RGB,
+        а профиль CMYK-снимка отбрасывается.
+        """
+        profile = b'fake-icc-profile'
+        rgb = self.clean_image(self.upload('rgb.jpg', 'JPEG',
+                                           icc_profile=profile))
+        cmyk = self.clean_image(self.upload('cmyk.jpg', 'JPEG', mode='CMYK',
+                                            icc_profile=profile))
+        with Image.open(rgb) as saved:
+            self.assertEqual(saved.info.get('icc_profile'), profile)
+        with Image.open(cmyk) as saved:
+            self.assertEqual(saved.mode, 'RGB')
+            self.assertNotIn('icc_profile', saved.info)
+
+    def test_post_keeps_image_when_edited_without_upload(self):
+        """Проверяем, что правка поста без новой картинки её не трогает."""
+        user = User.objects.create(username='editor')
+        post = Post.objects.create(
+            text='Пост', author=user,
+            image=self.upload('kept.png', 'PNG', size=(10, 10))
+        )
+        name = post.image.name
+        form = PostForm(data={'text': 'Правка'}, instance=post)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().image.name, name)
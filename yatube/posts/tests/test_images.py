@@ -0,0 +1,438 @@
+from io import BytesIO, StringIO
+import os
+import re
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import get_template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail.images import ImageFile
+
+from posts import resize
+from posts.models import MediaFile, Post
+from posts.storage import ContentAddressedStorage
+from posts.thumbnails import (CARD_THUMBNAIL, GEOMETRIES, delete_unreferenced,
+                              generate, thumbnail_file, thumbnail_size)
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+THUMBNAIL_TAG = re.compile(
+    r'{% thumbnail post\.image "(?P<geometry>[^"]+)" (?P<options>.*?) as'
+)
+GET_IMAGE = 'sorl.thumbnail.engines.pil_engine.Engine.get_image'
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPipelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='photographer')
+        cls.post = Post.objects.create(
+            text='Пост с картинкой',
+            author=cls.user,
+            image=SimpleUploadedFile('pipeline.gif', SMALL_GIF,
+                                     content_type='image/gif')
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_geometries_match_templates(self):
+        """Проверяем, что пайплайн строит все миниатюры из шаблонов."""
+        for name in ('posts/includes/post_card.html',
+                     'posts/post_detail.html'):
+            source = get_template(name).template.source
+            for tag in THUMBNAIL_TAG.finditer(source):
+                options = dict(
+                    (key, value.strip('"') if value.startswith('"')
+                     else value == 'True')
+                    for key, value in (
+                        option.split('=')
+                        for option in tag.group('options').split()
+                    )
+                )
+                with self.subTest(template=name):
+                    self.assertIn((tag.group('geometry'), options),
+                                  GEOMETRIES)
+
+    def test_pages_do_not_decode_generated_images(self):
+        """Проверяем, что после пайплайна страницы не декодируют картинки."""
+        generate(self.post.image.name)
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+        )
+        with mock.patch(GET_IMAGE) as get_image:
+            for url in urls:
+                with self.subTest(url=url):
+                    response = self.authorized_client.get(url)
+                    self.assertContains(response, '/media/cache/')
+        get_image.assert_not_called()
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_warm_thumbnails_without_workers(self):
+        """Проверяем, что без пула команда строит миниатюры сама."""
+        call_command('warm_thumbnails', stdout=StringIO())
+        thumbnail = thumbnail_file(self.post.image, *CARD_THUMBNAIL)
+        self.assertTrue(thumbnail.exists())
+
+    def test_views_schedule_thumbnails(self):
+        """Проверяем, что создание и правка картинки запускают пайплайн."""
+        with mock.patch('posts.views.schedule') as schedule:
+            self.authorized_client.post(reverse('posts:post_create'), {
+                'text': 'Новый пост',
+                'image': SimpleUploadedFile('new.gif', SMALL_GIF,
+                                            content_type='image/gif'),
+            })
+            post = Post.objects.get(text='Новый пост')
+            schedule.assert_called_once_with(post)
+            schedule.reset_mock()
+            edit = reverse('posts:post_edit', kwargs={'post_id': post.id})
+            self.authorized_client.post(edit, {'text': 'Только текст'})
+            schedule.assert_not_called()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPrefetchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cache.clear()
+        cls.user = User.objects.create(username='gallery')
+        for i in range(3):
+            post = Post.objects.create(
+                text=f'Картинка {i}',
+                author=cls.user,
+                image=SimpleUploadedFile(f'feed{i}.gif', SMALL_GIF,
+                                         content_type='image/gif')
+            )
+            generate(post.image.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_feed_reads_thumbnails_in_one_query(self):
+        """Проверяем, что лента читает миниатюры страницы одним запросом
+        и не декодирует картинки.
+        """
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch(GET_IMAGE) as get_image:
+            response = self.client.get(reverse('posts:index'))
+        lookups = [query['sql'] for query in queries.captured_queries
+                   if 'thumbnail_kvstore' in query['sql']]
+        self.assertEqual(len(lookups), 1, lookups)
+        self.assertIn(' IN ', lookups[0])
+        self.assertContains(response, '/media/cache/', count=3)
+        get_image.assert_not_called()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@mock.patch('posts.thumbnails.MODERN_FORMATS', (('PNG', 'image/png'),))
+class ResponsiveImagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='responsive')
+        cls.post = Post.objects.create(
+            text='Картинка для srcset',
+            author=cls.user,
+            image=SimpleUploadedFile('srcset.gif', SMALL_GIF,
+                                     content_type='image/gif')
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pipeline_adds_sources_to_cached_cards(self):
+        """Проверяем, что после пайплайна карточка в ленте получает
+        srcset из готовых вариантов, а страница не строит их сама.
+        """
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, '<source')
+        self.assertContains(response, 'loading="lazy"')
+        generate(self.post.image.name)
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch(GET_IMAGE) as get_image:
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<source type="image/png"')
+        for width in (480, 960, 1440):
+            self.assertContains(response, f'.png {width}w')
+        lookups = [query for query in queries.captured_queries
+                   if 'thumbnail_kvstore' in query['sql']]
+        self.assertLessEqual(len(lookups), 1)
+        get_image.assert_not_called()
+
+    def test_post_detail_sources(self):
+        """Проверяем srcset картинки на странице поста."""
+        generate(self.post.image.name)
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        )
+        self.assertContains(response, '.png 700w, ')
+        self.assertContains(response, '.png 1400w')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTest(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reposter')
+
+    def create_post(self, name, content=SMALL_GIF):
+        return Post.objects.create(
+            text='Репост', author=self.user,
+            image=SimpleUploadedFile(name, content, content_type='image/gif')
+        )
+
+    def test_duplicates_share_file_until_last_reference(self):
+        """Проверяем, что одинаковые картинки хранятся одним файлом
+        с общими миниатюрами и удаляются после последней ссылки.
+        """
+        first = self.create_post('meme.gif')
+        second = self.create_post('meme_copy.GIF')
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(MediaFile.objects.get(name=name).refs, 2)
+        generate(name)
+        storage = first.image.storage
+        thumbnail = thumbnail_file(first.image, *CARD_THUMBNAIL)
+        self.assertTrue(thumbnail.exists())
+
+        first.delete()
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).refs, 1)
+
+        second.image = SimpleUploadedFile('other.gif', SMALL_GIF + b'\0',
+                                          content_type='image/gif')
+        second.save()
+        self.assertNotEqual(second.image.name, name)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(thumbnail.exists())
+        self.assertFalse(MediaFile.objects.filter(name=name).exists())
+        self.assertEqual(MediaFile.objects.get(name=second.image.name).refs,
+                         1)
+
+    def test_reused_file_survives_concurrent_release(self):
+        """Проверяем, что удаление последней ссылки на файл, пришедшее
+        между проверкой хранилища и сохранением поста, не стирает файл.
+        """
+        first = self.create_post('meme.gif')
+        name = first.image.name
+        exists = ContentAddressedStorage.exists
+
+        def release_while_saving(storage, checked):
+            found = exists(storage, checked)
+            if checked == name:
+                MediaFile.release(name)
+                delete_unreferenced(name)
+            return found
+
+        with mock.patch.object(ContentAddressedStorage, 'exists',
+                               autospec=True,
+                               side_effect=release_while_saving):
+            second = self.create_post('meme_copy.gif')
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(second.image.storage.exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).refs, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImagePlaceholderTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='placeholder')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def photo(self, name='photo.jpg', size=(600, 300)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'blue').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(),
+                                  content_type='image/jpeg')
+
+    def test_upload_stores_dimensions_and_placeholder(self):
+        """Проверяем, что при загрузке сохраняются размеры картинки
+        и заглушка, а лента выводит их в карточке.
+        """
+        self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Фото', 'image': self.photo(),
+        })
+        post = Post.objects.get(text='Фото')
+        self.assertEqual((post.image_width, post.image_height), (600, 300))
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,')
+        )
+        self.assertLess(len(post.image_placeholder), 1000)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, post.image_placeholder)
+
+    def test_cards_use_stored_dimensions(self):
+        """Проверяем, что размеры <img> берутся из поста,
+        а не из хранилища миниатюр.
+        """
+        post = Post.objects.create(text='Фото', author=self.user,
+                                   image=self.photo(size=(300, 600)))
+        generate(post.image.name)
+        with mock.patch.object(ImageFile, 'size',
+                               new_callable=mock.PropertyMock) as size:
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'width="960" height="339"')
+        size.assert_not_called()
+
+    def test_thumbnail_size_follows_geometry_options(self):
+        """Проверяем расчёт размера миниатюры по сохранённым размерам."""
+        self.assertEqual(thumbnail_size(300, 600, '960x339'), (960, 339))
+        self.assertEqual(thumbnail_size(3000, 600, '1400x800'), (1400, 800))
+        with mock.patch('posts.thumbnails.GEOMETRIES', (('100x100', {}),)):
+            self.assertEqual(thumbnail_size(600, 300, '100x100'), (100, 50))
+            self.assertEqual(thumbnail_size(50, 25, '100x100'), (50, 25))
+
+    def test_text_edit_keeps_placeholder(self):
+        """Проверяем, что правка текста не пересчитывает заглушку."""
+        post = Post.objects.create(text='Фото', author=self.user,
+                                   image=self.photo())
+        with mock.patch('posts.images.measure') as measure:
+            post.text = 'Подпись'
+            post.save()
+        measure.assert_not_called()
+
+    def test_command_fills_old_posts(self):
+        """Проверяем, что команда заполняет заглушки старых постов."""
+        post = Post.objects.create(text='Старое фото', author=self.user,
+                                   image=self.photo(size=(300, 400)))
+        Post.objects.filter(pk=post.pk).update(image_width=None,
+                                               image_height=None,
+                                               image_placeholder='')
+        call_command('measure_images', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (300, 400))
+        self.assertTrue(post.image_placeholder)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   RESIZE_CACHE_ROOT=os.path.join(TEMP_MEDIA_ROOT, 'resized'))
+class ResizeEndpointTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='resizer')
+        buffer = BytesIO()
+        Image.new('RGB', (800, 400), 'green').save(buffer, 'JPEG')
+        cls.post = Post.objects.create(
+            text='Большая картинка', author=cls.user,
+            image=SimpleUploadedFile('wide.jpg', buffer.getvalue(),
+                                     content_type='image/jpeg')
+        )
+        cls.name = cls.post.image.name
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_signed_url_is_resized_and_cached(self):
+        """Проверяем, что подписанная ссылка отдаёт уменьшенную картинку
+        с долгим кэшированием, а повтор берётся из дискового кэша.
+        """
+        url = resize.resized_url(self.name, 200, 200)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as im:
+            self.assertEqual(im.size, (200, 100))
+        etag = response['ETag']
+        with mock.patch('posts.resize.resize') as resize_image:
+            response = self.client.get(url)
+            self.assertEqual(response['ETag'], etag)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        resize_image.assert_not_called()
+
+    def test_unsigned_or_oversized_urls_are_rejected(self):
+        """Проверяем, что без подписи и сверх предела ресайз запрещён
+        даже с известным ETag, а отказ приходит без ETag.
+        """
+        signed = resize.resized_url(self.name, 300, 300)
+        urls = (
+            signed.split('?')[0],
+            signed.replace('300x300', '301x301'),
+            resize.resized_url(self.name, 5000, 5000),
+        )
+        etag = self.client.get(signed)['ETag']
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 403)
+                self.assertFalse(response.has_header('ETag'))
+        missing = resize.resized_url('posts/missing.jpg', 300, 300)
+        response = self.client.get(missing)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_evict_removes_least_recently_read(self):
+        """Проверяем, что шард кэша освобождается от давно не читанных
+        файлов.
+        """
+        shard = tempfile.mkdtemp(dir=TEMP_MEDIA_ROOT)
+        for age, name in enumerate(('new', 'old', 'oldest')):
+            path = os.path.join(shard, name)
+            with open(path, 'wb') as file_:
+                file_.write(b'x' * 10)
+            os.utime(path, (1000 - age, 1000 - age))
+        resize.evict(shard, 20)
+        self.assertEqual(sorted(os.listdir(shard)), ['new', 'old'])
@@ -1,11 +1,13 @@
 import shutil
 import tempfile
+from io import StringIO
 
 from django.contrib.auth import get_user_model
 from django.test import TestCase, override_settings
 from django.conf import settings
+from django.core.management import call_command
 
-from ..models import Group, Post
+from ..models import AuthorStats, Follow, Group, Post
 
 User = get_user_model()
 
@@ -44,3 +46,52 @@ class PostModelTest(TestCase):
         group_value = str(self.group)
         expected_value = self.group.title
         self.assertEqual(group_value, expected_value)
+
+
+class AuthorStatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='author')
+
+    def test_posts_count_follows_creates_and_deletes(self):
+        """Проверяем, что счётчик постов меняется при создании и удалении
+        поста.
+        """
+        posts = [Post.objects.create(text=f'Пост {i}', author=self.user)
+                 for i in range(3)]
+        self.assertEqual(self.user.stats.posts_count, 3)
+        posts[0].delete()
+        Post.objects.filter(id=posts[1].id).delete()
+        self.user.stats.refresh_from_db()
+        self.assertEqual(self.user.stats.posts_count, 1)
+
+    def test_drifted_counter_does_not_go_below_zero(self):
+        """Проверяем, что удаление поста при обнулённом счётчике
+        не падает и оставляет счётчик нулевым.
+        """
+        post = Post.objects.create(text='Пост', author=self.user)
+        AuthorStats.objects.filter(author=self.user).update(posts_count=0)
+        post.delete()
+        self.assertEqual(AuthorStats.objects.get(author=self.user).posts_count,
+                         0)
+
+    def test_recount_posts_repairs_counters(self):
+        """Проверяем, что команда recount_posts восстанавливает счётчики
+        постов и подписчиков.
+        """
+        Post.objects.create(text='Пост', author=self.user)
+        Post.objects.bulk_create([Post(text='Без сигнала', author=self.user)])
+        other = User.objects.create(username='other')
+        Post.objects.bulk_create([Post(text='Чужой пост', author=other)])
+        Follow.objects.bulk_create([Follow(user=other, author=self.user)])
+        call_command('recount_posts', stdout=StringIO())
+        stats = AuthorStats.objects.get(author=self.user)
+        self.assertEqual((stats.posts_count, stats.followers_count), (2, 1))
+        self.assertEqual(AuthorStats.objects.get(author=other).posts_count, 1)
+
+    def test_deleting_author_with_posts(self):
+        """Проверяем, что автора можно удалить вместе с постами."""
+        user = User.objects.create(username='leaving')
+        Post.objects.create(text='Пост', author=user)
+        user.delete()
+        self.assertFalse(AuthorStats.objects.exists())
@@ -1,17 +1,32 @@
 from datetime import datetime
 import tempfile
 import shutil
+from time import time
+from unittest import mock
+import warnings
 
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.conf import settings
 from django import forms
 from django.core.cache import cache
+from django.core.paginator import UnorderedObjectListWarning
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.http import HttpResponse
 
-from posts.models import Post, Group, Follow, Comment
+from posts.models import (Post, Group, Follow, Comment, PostTag, Tag,
+                          TimelineEntry)
+from posts import caching
+from posts.caching import LOCK_KEY, fetch, get_version
 from posts.forms import PostForm
+from posts.hashtags import extract_tags
+from posts.helpers import page_window
+from core.decorators import QueryBudgetExceeded, query_budget
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -289,15 +304,62 @@ class PostPagesTest(TestCase):
         response = self.reader_user.get(reverse('posts:follow_index'))
         self.assertNotContains(response, new_post)
 
+    def test_timeline_follows_subscriptions(self):
+        """Проверяем, что лента подписок заполняется при подписке и новом
+        посте и очищается при отписке.
+        """
+        entries = TimelineEntry.objects.filter(user=self.user)
+        self.assertEqual(list(entries.values_list('post', flat=True)),
+                         [self.other_post.id])
+        new_post = Post.objects.create(text='Новый пост',
+                                       author=self.other_user)
+        self.assertTrue(entries.filter(post=new_post).exists())
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.other_user.username})
+        )
+        self.assertFalse(entries.exists())
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2)
+    def test_celebrity_posts_pulled_into_follow_page(self):
+        """Проверяем, что посты авторов с большим числом подписчиков не
+        раскладываются по лентам, но попадают в ленту подписок при чтении.
+        """
+        Follow.objects.create(user=self.other_user, author=self.user)
+        fan = User.objects.create(username='fan')
+        Follow.objects.create(user=fan, author=self.user)
+        new_post = Post.objects.create(text='Пост звезды', author=self.user)
+        self.assertFalse(
+            TimelineEntry.objects.filter(post=new_post).exists()
+        )
+        response = self.reader_user.get(reverse('posts:follow_index'))
+        self.assertIn(new_post, response.context['page_obj'])
+        self.assertIn(self.post, response.context['page_obj'])
+
+    def test_group_link_separator(self):
+        """Проверяем, что в профиле и ленте подписок под ссылкой на
+        группу есть разделитель, а на главной его нет.
+        """
+        pages = (
+            (reverse('posts:profile', kwargs={'username': self.other_user}),
+             1),
+            (reverse('posts:follow_index'), 1),
+            (reverse('posts:index'), 0),
+        )
+        for url, count in pages:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, '<hr>', count=count)
+
     def test_image_index(self):
         """Проверяем, что при выводе поста с картинкой изображение передаётся
         в словаре context на главную страницу(index).
         """
         form_data = self.form_data
-        uploaded = self.uploaded
         post = Post.objects.latest('id')
         self.assertEqual(post.text, form_data['text'])
-        self.assertEqual(post.image, f'posts/{uploaded}')
+        self.assertRegex(post.image.name,
+                         r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.gif$')
 
     def test_image_profile(self):
         """Проверяем, что при выводе поста с картинкой изображение передаётся
@@ -335,6 +397,129 @@ class PostPagesTest(TestCase):
         self.assertContains(response, 'Тестовый комментарий')
 
 
+class TimelineRebalanceTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='star')
+        self.fans = [User.objects.create(username=f'fan{number}')
+                     for number in range(3)]
+        self.post = Post.objects.create(text='Пост звезды',
+                                        author=self.author)
+
+    def follow_all(self):
+        for fan in self.fans:
+            Follow.objects.create(user=fan, author=self.author)
+
+    def timeline_users(self):
+        return set(TimelineEntry.objects.filter(
+            post=self.post
+        ).values_list('user', flat=True))
+
+    def rebalance(self):
+        call_command('rebalance_timelines', stdout=mock.Mock())
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=3)
+    def test_promotion_is_immediate_and_cleanup_deferred(self):
+        """Проверяем, что автор, набравший порог, сразу перестаёт
+        раскладываться по лентам, а прежние записи убирает команда.
+        """
+        Follow.objects.create(user=self.fans[0], author=self.author)
+        self.assertEqual(self.timeline_users(), {self.fans[0].id})
+        with CaptureQueriesContext(connection) as queries:
+            Follow.objects.create(user=self.fans[1], author=self.author)
+            Follow.objects.create(user=self.fans[2], author=self.author)
+        self.assertLess(len(queries), 20)
+        new_post = Post.objects.create(text='Новый пост',
+                                       author=self.author)
+        self.assertFalse(
+            TimelineEntry.objects.filter(post=new_post).exists()
+        )
+        self.assertEqual(self.timeline_users(),
+                         {self.fans[0].id, self.fans[1].id})
+        self.rebalance()
+        self.assertEqual(self.timeline_users(), set())
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=3,
+                       FEED_CELEBRITY_LOW_THRESHOLD=2)
+    def test_demotion_below_low_threshold(self):
+        """Проверяем, что «звезда» возвращается в ленты только ниже
+        нижнего порога, в том числе после отписки пачкой.
+        """
+        self.follow_all()
+        self.rebalance()
+        Follow.objects.filter(user=self.fans[2]).delete()
+        self.rebalance()
+        self.assertEqual(self.timeline_users(), set())
+        Follow.objects.create(user=self.fans[2], author=self.author)
+        Follow.objects.filter(user__in=self.fans[1:]).delete()
+        self.assertEqual(self.timeline_users(), set())
+        self.rebalance()
+        self.assertEqual(self.timeline_users(), {self.fans[0].id})
+
+    def test_threshold_change_is_applied_by_command(self):
+        """Проверяем, что команда выравнивает ленты после смены порога."""
+        with override_settings(FEED_CELEBRITY_THRESHOLD=2):
+            self.follow_all()
+            self.rebalance()
+        self.assertEqual(self.timeline_users(), set())
+        self.rebalance()
+        self.assertEqual(self.timeline_users(),
+                         {fan.id for fan in self.fans})
+        with override_settings(FEED_CELEBRITY_THRESHOLD=2):
+            self.rebalance()
+        self.assertEqual(self.timeline_users(), set())
+
+
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='commentator')
+        cls.post = Post.objects.create(text='Обсуждаемый пост',
+                                       author=cls.user)
+        for i in range(25):
+            Comment.objects.create(post=cls.post, author=cls.user,
+                                   text=f'Комментарий №{i}.')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_post_detail_shows_first_comments(self):
+        """Проверяем, что на странице поста выводится первая порция
+        комментариев и ссылка на следующую.
+        """
+        response = self.client.get(reverse('posts:post_detail',
+                                           kwargs={'post_id': self.post.id}))
+        comments = response.context['comments']
+        self.assertEqual(len(comments), 20)
+        self.assertContains(response, 'Комментарий №0.')
+        self.assertNotContains(response, 'Комментарий №20.')
+        chunk_url = reverse('posts:comments',
+                            kwargs={'post_id': self.post.id})
+        self.assertContains(response, chunk_url)
+
+    def test_comments_chunk_returns_next_comments(self):
+        """Проверяем, что подгрузка отдаёт только следующую порцию."""
+        response = self.client.get(reverse('posts:post_detail',
+                                           kwargs={'post_id': self.post.id}))
+        cursor = response.context['comments'].next_cursor
+        response = self.client.get(reverse('posts:comments',
+                                           kwargs={'post_id': self.post.id}),
+                                   {'cursor': cursor})
+        self.assertTemplateUsed(response, 'posts/includes/comment_list.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertContains(response, 'Комментарий №20.')
+        self.assertNotContains(response, 'Комментарий №19.')
+        self.assertNotContains(response, 'load-more')
+
+    def test_comments_are_paginated_without_warning(self):
+        """Проверяем, что пагинатор сам упорядочивает комментарии."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', UnorderedObjectListWarning)
+            response = self.client.get(reverse('posts:comments',
+                                               kwargs={'post_id':
+                                                       self.post.id}))
+        self.assertEqual(response.status_code, 200)
+
+
 class PaginatorViewsTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -403,6 +588,584 @@ class PaginatorViewsTest(TestCase):
                                    )
         self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_feed_count_cached_until_write(self):
+        """Проверяем, что число постов ленты берётся из кэша и
+        сбрасывается после публикации поста.
+        """
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        self.client.get(url)
+        self.assertEqual(cache.get(f'feed_count:group:{self.group.id}'), 13)
+        Post.objects.create(text='Новый пост', author=self.user,
+                            group=self.group)
+        self.assertIsNone(cache.get(f'feed_count:group:{self.group.id}'))
+        response = self.client.get(url, {'page': 2})
+        self.assertEqual(len(response.context['page_obj']), 4)
+
+    def test_cursor_pagination_for_index(self):
+        """Проверяем, что пагинация по курсору отдаёт страницы по 10 постов
+        и позволяет вернуться на более новую страницу.
+        """
+        response = self.client.get(reverse('posts:index'), {'cursor': ''})
+        first_page = response.context['page_obj']
+        self.assertEqual(len(first_page), 10)
+        self.assertFalse(first_page.has_previous())
+        response = self.client.get(reverse('posts:index'),
+                                   {'cursor': first_page.next_cursor})
+        second_page = response.context['page_obj']
+        self.assertEqual(len(second_page), 3)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(set(first_page).isdisjoint(second_page))
+        response = self.client.get(reverse('posts:index'),
+                                   {'cursor': second_page.previous_cursor})
+        self.assertEqual(list(response.context['page_obj']),
+                         list(first_page))
+
+    def test_cursor_pagination_ignores_broken_cursor(self):
+        """Проверяем, что некорректный курсор открывает первую страницу."""
+        response = self.client.get(reverse('posts:group_list',
+                                   kwargs={'slug': self.group.slug}),
+                                   {'cursor': 'broken'})
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='planner')
+        cls.author = User.objects.create(username='planned')
+        cls.group = Group.objects.create(title='Группа', slug='plan')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.post = Post.objects.create(text='Пост #план', author=cls.author,
+                                       group=cls.group)
+        Comment.objects.create(post=cls.post, author=cls.user,
+                               text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_feed_queries_use_indexes(self):
+        """Проверяем, что запросы лент и комментариев читают данные
+        по индексу и не сортируют результат во временном B-дереве.
+        """
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:index') + '?cursor=',
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('posts:comments', kwargs={'post_id': self.post.id}),
+            reverse('posts:follow_index'),
+            reverse('posts:follow_index') + '?feed=merge',
+            reverse('posts:tag_list', kwargs={'name': 'план'}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assert_indexed_queries(url)
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=1)
+    def test_pulled_feed_queries_use_indexes(self):
+        """Проверяем, что лента с постами «звёзд» читает обе части по
+        индексам. Сортируется только уже отобранная лента пользователя.
+        """
+        call_command('rebalance_timelines', stdout=mock.Mock())
+        self.assert_indexed_queries(reverse('posts:follow_index'),
+                                    sorted_subset=True)
+
+    def assert_indexed_queries(self, url, sorted_subset=False):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'ORDER BY' not in sql:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                steps = [row[-1] for row in cursor.fetchall()]
+            plan = ' '.join(steps)
+            for step in steps:
+                if step.startswith('SCAN'):
+                    self.assertIn('USING', step, sql)
+            if sorted_subset:
+                self.assertIn('MULTI-INDEX OR', plan, sql)
+            else:
+                self.assertNotIn('TEMP B-TREE', plan, sql)
+            self.assertIn('INDEX', plan, sql)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='searcher')
+        cls.weak = Post.objects.create(
+            text='Кот сидел на окне, а потом ушёл гулять по крыше',
+            author=cls.user)
+        cls.strong = Post.objects.create(text='Кот и кот', author=cls.user)
+        cls.other = Post.objects.create(text='Собака', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_search_ranks_matching_posts(self):
+        """Проверяем, что поиск находит посты и упорядочивает их по
+        релевантности.
+        """
+        response = self.client.get(reverse('posts:search'), {'q': 'кот'})
+        self.assertEqual(list(response.context['page_obj']),
+                         [self.strong, self.weak])
+
+    def test_search_index_follows_post_changes(self):
+        """Проверяем, что индекс обновляется при изменении и удалении
+        постов.
+        """
+        Post.objects.filter(id=self.other.id).update(text='Кошка')
+        response = self.client.get(reverse('posts:search'), {'q': 'кошк'})
+        self.assertEqual(list(response.context['page_obj']), [self.other])
+        self.other.delete()
+        response = self.client.get(reverse('posts:search'), {'q': 'кошка'})
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_search_paginates_by_cursor(self):
+        """Проверяем, что результаты поиска листаются по курсору."""
+        Post.objects.bulk_create([
+            Post(text=f'Кот номер {i}', author=self.user) for i in range(12)
+        ])
+        response = self.client.get(reverse('posts:search'), {'q': 'кот'})
+        first_page = response.context['page_obj']
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': 'кот',
+                                    'cursor': first_page.next_cursor})
+        second_page = response.context['page_obj']
+        self.assertEqual(len(first_page) + len(second_page), 14)
+        self.assertTrue(set(first_page).isdisjoint(second_page))
+
+    def test_search_pages_follow_snapshot(self):
+        """Проверяем, что новые посты и сдвиг релевантности не дают
+        пропусков и повторов при листании.
+        """
+        Post.objects.bulk_create([
+            Post(text=f'Кот номер {i}', author=self.user) for i in range(12)
+        ])
+        url = reverse('posts:search')
+        first_page = self.client.get(url, {'q': 'кот'}).context['page_obj']
+        Post.objects.bulk_create([
+            Post(text='Кот кот кот', author=self.user) for _ in range(5)
+        ])
+        second_page = self.client.get(
+            url, {'q': 'кот', 'cursor': first_page.next_cursor}
+        ).context['page_obj']
+        found = list(first_page) + list(second_page)
+        self.assertEqual(len(found), 14)
+        self.assertEqual(len(set(found)), 14)
+        previous_page = self.client.get(
+            url, {'q': 'кот', 'cursor': second_page.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(list(previous_page), list(first_page))
+
+    def test_search_without_words(self):
+        """Проверяем, что пустой запрос и запрос без слов не падают
+        и не ищут.
+        """
+        for query in ('', '!!!'):
+            with self.subTest(query=query):
+                response = self.client.get(reverse('posts:search'),
+                                           {'q': query})
+                self.assertEqual(response.status_code, 200)
+                self.assertIsNone(response.context['page_obj'])
+        response = self.client.get(reverse('posts:search'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_first_page_reuses_snapshot(self):
+        """Проверяем, что повторный запрос первой страницы берёт
+        готовый снимок, пока посты не менялись.
+        """
+        url = reverse('posts:search')
+        first = self.client.get(url, {'q': 'Кот'}).context['page_obj']
+        with CaptureQueriesContext(connection) as queries:
+            again = self.client.get(url, {'q': 'кот'}).context['page_obj']
+        self.assertEqual(list(again), list(first))
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'LIMIT 1000' in query['sql']])
+        Post.objects.create(text='Ещё кот', author=self.user)
+        fresh = self.client.get(url, {'q': 'кот'}).context['page_obj']
+        self.assertEqual(len(fresh), 3)
+
+    def test_admin_search_uses_index(self):
+        """Проверяем, что поиск в админке идёт через тот же индекс."""
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:posts_post_changelist'),
+                                   {'q': 'собак'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.other])
+
+    def test_search_ignores_query_syntax(self):
+        """Проверяем, что спецсимволы запроса не ломают поиск."""
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': '"кот OR ('})
+        self.assertEqual(response.status_code, 200)
+
+
+class TagTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='tagger')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_extract_tags(self):
+        """Проверяем разбор хэштегов из текста поста."""
+        self.assertEqual(
+            extract_tags('#Кот и #пёс, ещё раз #кот; a#b &#39; #' + 'x' * 65),
+            ['кот', 'пёс']
+        )
+
+    def test_tags_follow_post_text(self):
+        """Проверяем, что связи и счётчики тегов следуют за текстом поста
+        при создании, редактировании и удалении.
+        """
+        post = Post.objects.create(text='#кот #пёс', author=self.user)
+        other = Post.objects.create(text='#кот', author=self.user)
+        self.assertEqual(self.counts(), {'кот': 2, 'пёс': 1})
+        post.text = '#кот #мышь'
+        post.save()
+        self.assertEqual(self.counts(), {'кот': 2, 'пёс': 0, 'мышь': 1})
+        other.delete()
+        self.assertEqual(self.counts(), {'кот': 1, 'пёс': 0, 'мышь': 1})
+        self.assertEqual(list(post.post_tags.values_list('tag__name',
+                                                         flat=True)),
+                         ['кот', 'мышь'])
+
+    def test_drifted_counter_does_not_break_delete(self):
+        """Проверяем, что удаление поста при обнулённом счётчике тега
+        не падает, а команда recount_tags восстанавливает счётчики.
+        """
+        post = Post.objects.create(text='#кот', author=self.user)
+        Post.objects.create(text='#кот #пёс', author=self.user)
+        Tag.objects.update(posts_count=0)
+        post.delete()
+        self.assertEqual(self.counts(), {'кот': 0, 'пёс': 0})
+        call_command('recount_tags', stdout=mock.Mock())
+        self.assertEqual(self.counts(), {'кот': 1, 'пёс': 1})
+
+    def test_link_created_in_parallel_is_not_counted(self):
+        """Проверяем, что связь, которую успело создать параллельное
+        сохранение, не увеличивает счётчик второй раз.
+        """
+        post = Post.objects.create(text='Без тегов', author=self.user)
+        create_tags = Tag.objects.bulk_create
+
+        def parallel_save(*args, **kwargs):
+            created = create_tags(*args, **kwargs)
+            tag = Tag.objects.get(name='кот')
+            PostTag.objects.create(post=post, tag=tag,
+                                   pub_date=post.pub_date)
+            Tag.change_posts_count([tag.id], 1)
+            return created
+
+        post.text = '#кот'
+        with mock.patch.object(Tag.objects, 'bulk_create',
+                               side_effect=parallel_save):
+            post.save()
+        self.assertEqual(self.counts(), {'кот': 1})
+
+    def test_tag_page_paginates_by_cursor(self):
+        """Проверяем, что лента хэштега листается курсором от новых
+        постов к старым и не содержит чужих постов.
+        """
+        posts = [Post.objects.create(text=f'Пост {i} #Лето',
+                                     author=self.user) for i in range(12)]
+        Post.objects.create(text='Без тега', author=self.user)
+        url = reverse('posts:tag_list', kwargs={'name': 'лето'})
+        response = self.client.get(url)
+        self.assertEqual(response.context['tag'].posts_count, 12)
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), posts[:1:-1])
+        response = self.client.get(url, {'cursor': page_obj.next_cursor})
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), posts[1::-1])
+        self.assertFalse(page_obj.has_next())
+        response = self.client.get(url, {'cursor': page_obj.previous_cursor})
+        self.assertEqual(list(response.context['page_obj']), posts[:1:-1])
+
+    def test_unknown_tag_not_found(self):
+        """Проверяем, что страница неизвестного тега отдаёт 404."""
+        response = self.client.get(
+            reverse('posts:tag_list', kwargs={'name': 'нет'})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def counts(self):
+        return dict(Tag.objects.values_list('name', 'posts_count'))
+
+
+class PageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='writer')
+        cls.post = Post.objects.create(text='Закэшированный пост',
+                                       author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_anonymous_page_is_served_from_cache(self):
+        """Проверяем, что повторный анонимный запрос отдаётся из кэша
+        без запросов к БД, а новый пост сбрасывает кэш.
+        """
+        url = reverse('posts:index')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, self.post.text)
+        self.assertEqual(
+            self.client.get(url, {'page': 2})['X-Page-Cache'], 'miss'
+        )
+        Post.objects.create(text='Свежий пост', author=self.author)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Свежий пост')
+
+    def test_cached_page_gets_personal_header(self):
+        """Проверяем, что авторизованный пользователь получает общую
+        страницу из кэша со своей шапкой и переключателем лент.
+        """
+        url = reverse('posts:index')
+        self.assertContains(self.client.get(url), 'Войти')
+        response = self.authorized_client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Пользователь: reader')
+        self.assertContains(response, 'Избранные авторы')
+        self.assertNotContains(response, 'Войти')
+        self.assertContains(response, self.post.text)
+        self.assertContains(self.client.get(url), 'Войти')
+
+    def test_stale_page_while_another_request_renders(self):
+        """Проверяем, что пока страницу перерисовывает другой запрос,
+        анонимный получает прежнюю, помеченную как устаревшая.
+        """
+        url = reverse('posts:index')
+        self.client.get(url)
+        key = caching.page_key('index', RequestFactory().get(url))
+        cache.add(LOCK_KEY.format(key), 1)
+        Post.objects.create(text='Свежий пост', author=self.author)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'stale')
+        self.assertNotContains(response, 'Свежий пост')
+        response = self.authorized_client.get(url)
+        self.assertNotIn('X-Page-Cache', response)
+
+    def test_stale_page_on_database_error(self):
+        """Проверяем, что при ошибке БД лента отдаёт прежнюю отрисовку
+        с пометкой и ставит перерисовку в очередь.
+        """
+        url = reverse('posts:index')
+        self.client.get(url)
+        Post.objects.create(text='Свежий пост', author=self.author)
+        with mock.patch('posts.views.paginate',
+                        side_effect=OperationalError('database is locked')), \
+                mock.patch.object(caching, 'queue_refresh') as queue:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Page-Cache'], 'stale')
+            self.assertContains(response, self.post.text)
+            self.assertNotContains(response, 'Свежий пост')
+            queue.assert_called_once()
+            response = self.authorized_client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'stale')
+            self.assertContains(response, 'Пользователь: reader')
+        queue.call_args[0][0]()
+        self.assertContains(self.client.get(url), 'Свежий пост')
+
+    def test_database_error_for_user_queues_anonymous_render(self):
+        """Проверяем, что прежняя отрисовка, отданная пользователю при
+        ошибке БД, перерисовывается в фоне от имени анонима.
+        """
+        url = reverse('posts:index')
+        self.client.get(url)
+        Post.objects.create(text='Свежий пост', author=self.author)
+        with mock.patch('posts.views.paginate',
+                        side_effect=OperationalError('database is locked')), \
+                mock.patch.object(caching, 'queue_refresh') as queue:
+            response = self.authorized_client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'stale')
+        queue.assert_called_once()
+        queue.call_args[0][0]()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Свежий пост')
+        self.assertContains(response, 'Войти')
+
+    def test_personal_pages_are_not_shared(self):
+        """Проверяем, что профиль авторизованному не отдаётся из кэша."""
+        url = reverse('posts:profile', kwargs={'username': self.author})
+        self.client.get(url)
+        response = self.authorized_client.get(url)
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'Подписаться')
+
+
+class FetchTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        caching._counters.clear()
+        self.render = mock.Mock(return_value='new')
+
+    def test_single_flight(self):
+        """Проверяем, что устаревшее значение перерисовывает только
+        получивший блокировку, а остальные получают прежнее.
+        """
+        self.assertEqual(fetch('key', 1, lambda: 'old', 60, 'test'),
+                         ('old', 'miss'))
+        self.assertEqual(fetch('key', 1, self.render, 60, 'test'),
+                         ('old', 'hit'))
+        cache.add(LOCK_KEY.format('key'), 1)
+        self.assertEqual(fetch('key', 2, self.render, 60, 'test'),
+                         ('old', 'stale'))
+        self.render.assert_not_called()
+        cache.delete(LOCK_KEY.format('key'))
+        self.assertEqual(fetch('key', 2, self.render, 60, 'test'),
+                         ('new', 'expired'))
+        self.assertIsNone(cache.get(LOCK_KEY.format('key')))
+
+    def test_early_recomputation(self):
+        """Проверяем, что долго рисуемое значение незадолго до срока
+        перерисовывается досрочно, а далеко до срока — нет.
+        """
+        cache.set('key', ('old', 1, time() + 10, 1.0))
+        with mock.patch.object(caching, 'random', return_value=0.0):
+            self.assertEqual(fetch('key', 1, self.render, 60, 'test'),
+                             ('old', 'hit'))
+        with mock.patch.object(caching, 'random', return_value=1 - 1e-9):
+            self.assertEqual(fetch('key', 1, self.render, 60, 'test'),
+                             ('new', 'early'))
+
+    def test_stale_while_revalidate(self):
+        """Проверяем, что с бюджетом истёкшее значение отдаётся сразу,
+        а перерисовка уходит в фон под блокировкой.
+        """
+        cache.set('key', ('old', 1, time() - 1, 0.0))
+        with mock.patch.object(caching, 'queue_refresh') as queue:
+            self.assertEqual(fetch('key', 1, self.render, 60, 'test', 1),
+                             ('old', 'refresh'))
+            self.assertEqual(fetch('key', 1, self.render, 60, 'test', 1),
+                             ('old', 'stale'))
+        self.render.assert_not_called()
+        queue.call_args[0][0]()
+        self.assertIsNone(cache.get(LOCK_KEY.format('key')))
+        self.assertEqual(fetch('key', 1, self.render, 60, 'test', 1),
+                         ('new', 'hit'))
+
+    def test_fallback_on_database_error(self):
+        """Проверяем, что устаревшее по версии значение отдаётся,
+        если перерисовка упала с ошибкой БД, а без бюджета ошибка
+        доходит до вызывающего.
+        """
+        cache.set('key', ('old', 1, time() + 60, 0.0))
+        self.render.side_effect = OperationalError
+        with mock.patch.object(caching, 'queue_refresh') as queue:
+            self.assertEqual(fetch('key', 2, self.render, 60, 'test', 1),
+                             ('old', 'fallback'))
+        queue.assert_called_once()
+        cache.delete(LOCK_KEY.format('key'))
+        with self.assertRaises(OperationalError):
+            fetch('key', 2, self.render, 60, 'test')
+
+    @override_settings(PAGE_REFRESH_WORKERS=0)
+    def test_fallback_releases_lock_without_workers(self):
+        """Проверяем, что без пула перерисовки блокировка после ошибки
+        БД снимается, а не висит до истечения.
+        """
+        cache.set('key', ('old', 1, time() + 60, 0.0))
+        self.render.side_effect = OperationalError
+        self.assertEqual(fetch('key', 2, self.render, 60, 'test', 1),
+                         ('old', 'fallback'))
+        self.assertIsNone(cache.get(LOCK_KEY.format('key')))
+
+    @override_settings(CACHE_STATS_INTERVAL=0)
+    def test_outcomes_are_counted(self):
+        """Проверяем, что пути fetch считаются в общем кэше."""
+        for _ in range(2):
+            fetch('key', 1, self.render, 60, 'test')
+        counts = caching.stats(['test'])['test']
+        self.assertEqual(counts['miss'], 1)
+        self.assertEqual(counts['hit'], 1)
+        self.assertEqual(counts['stale'], 0)
+
+
+class PageWindowTest(SimpleTestCase):
+    def test_page_window(self):
+        """Проверяем, что навигация показывает ограниченное окно страниц."""
+        self.assertEqual(page_window(1, 5), [1, 2, 3, 4, 5])
+        self.assertEqual(page_window(1, 1000), [1, 2, 3, None, 1000])
+        self.assertEqual(page_window(500, 1000),
+                         [1, None, 498, 499, 500, 501, 502, None, 1000])
+
+
+class MergeFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(username='reader')
+        authors = [User.objects.create(username=f'author{i}')
+                   for i in range(3)]
+        for author in authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        for i in range(13):
+            Post.objects.create(text=f'Пост {i}', author=authors[i % 3])
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+
+    def test_merge_feed_matches_join(self):
+        """Проверяем, что слияние потоков авторов даёт ту же ленту,
+        что и запрос через подписки.
+        """
+        expected = list(Post.objects.filter(
+            author__following__user=self.reader
+        ).order_by('-pub_date', '-id'))
+        response = self.client.get(reverse('posts:follow_index'),
+                                   {'feed': 'merge'})
+        first_page = response.context['page_obj']
+        self.assertEqual(list(first_page), expected[:10])
+        response = self.client.get(reverse('posts:follow_index'),
+                                   {'feed': 'merge',
+                                    'cursor': first_page.next_cursor})
+        self.assertEqual(list(response.context['page_obj']), expected[10:])
+
+
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+    @staticmethod
+    @query_budget(1)
+    def greedy_view(request):
+        list(User.objects.all())
+        list(Post.objects.all())
+        return HttpResponse()
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_budget_exceeded_raises_in_strict_mode(self):
+        """Проверяем, что превышение бюджета запросов — ошибка в тестах."""
+        with self.assertRaises(QueryBudgetExceeded):
+            self.greedy_view(self.request)
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_budget_exceeded_logged_in_production(self):
+        """Проверяем, что без строгого режима превышение попадает в лог."""
+        with self.assertLogs('core.decorators', level='WARNING'):
+            self.greedy_view(self.request)
+
+    def test_extra_queries_extend_budget(self):
+        """Проверяем, что представление может расширить бюджет запроса."""
+        self.request.extra_queries = 1
+        self.greedy_view(self.request)
+
 
 class CacheTest(TestCase):
     @classmethod
@@ -432,7 +1195,7 @@ class CacheTest(TestCase):
             with self.subTest(post=post):
                 self.assertContains(response, post)
 
-        Post.objects.all().delete()
+        Post.objects.update(text='Изменённый пост')
 
         response = self.authorized_client.get(reverse('posts:index'))
         self.assertContains(response, 'Тестовый пост 1')
@@ -441,3 +1204,45 @@ class CacheTest(TestCase):
 
         response = self.authorized_client.get(reverse('posts:index'))
         self.assertNotContains(response, 'Тестовый пост 1')
+
+    def test_cache_invalidated_on_post_changes(self):
+        """Проверяем, что кэш главной страницы сбрасывается сразу после
+        создания и удаления поста.
+        """
+        post = Post.objects.create(text='Первый пост', author=self.user)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Первый пост')
+        Post.objects.create(text='Второй пост', author=self.user)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Второй пост')
+        post.delete()
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Первый пост')
+
+    def test_post_cards_cached_across_requests(self):
+        """Проверяем, что карточка поста отрисовывается один раз и
+        перерисовывается после редактирования поста.
+        """
+        post = Post.objects.create(text='Карточка', author=self.user)
+        url = reverse('posts:profile', kwargs={'username': self.user})
+        response = self.authorized_client.get(url)
+        self.assertTemplateUsed(response, 'posts/includes/post_card.html')
+        response = self.authorized_client.get(url)
+        self.assertTemplateNotUsed(response,
+                                   'posts/includes/post_card.html')
+        self.assertContains(response, 'Карточка')
+        post.text = 'Новая карточка'
+        post.save()
+        response = self.authorized_client.get(url)
+        self.assertTemplateUsed(response, 'posts/includes/post_card.html')
+        self.assertContains(response, 'Новая карточка')
+
+    def test_cache_invalidated_on_group_changes(self):
+        """Проверяем, что переименование группы сбрасывает кэш главной."""
+        group = Group.objects.create(title='Группа', slug='cached')
+        Post.objects.create(text='Пост', author=self.user, group=group)
+        self.authorized_client.get(reverse('posts:index'))
+        version = get_version('index')
+        group.title = 'Новое название'
+        group.save()
+        self.assertNotEqual(get_version('index'), version)
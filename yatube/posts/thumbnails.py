@@ -0,0 +1,274 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import django
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from PIL import Image
+from sorl.thumbnail import base, default, delete, get_thumbnail
+from sorl.thumbnail.conf import defaults as thumbnail_defaults
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import serialize, tokey
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from . import caching
+from .models import MediaFile, Post
+
+logger = logging.getLogger(__name__)
+
+# Все миниатюры, которые строят шаблоны постов: геометрия и опции
+# должны совпадать с тегами {% thumbnail %} до символа, иначе
+# у миниатюры будет другой ключ.
+CARD_THUMBNAIL = ('960x339', {'crop': 'center', 'upscale': True})
+DETAIL_THUMBNAIL = ('1400x800', {'crop': 'center', 'upscale': True})
+GEOMETRIES = (CARD_THUMBNAIL, DETAIL_THUMBNAIL)
+
+# Ширины вариантов для srcset и форматы для <source> в порядке
+# предпочтения; строятся только те, что умеет сохранять Pillow.
+SRCSET_WIDTHS = {
+    CARD_THUMBNAIL[0]: (480, 960, 1440),
+    DETAIL_THUMBNAIL[0]: (700, 1400),
+}
+MODERN_FORMATS = (
+    ('AVIF', 'image/avif'),
+    ('WEBP', 'image/webp'),
+)
+
+_executor = None
+_prefetched = ContextVar('prefetched_thumbnails', default=None)
+
+
+class ThumbnailBackend(base.ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, который знает расширение AVIF."""
+    extensions = {**base.EXTENSIONS, 'AVIF': 'avif'}
+
+    def _get_thumbnail_filename(self, source, geometry_string, options):
+        key = tokey(source.key, geometry_string, serialize(options))
+        path = f'{key[:2]}/{key[2:4]}/{key}'
+        extension = self.extensions[options['format']]
+        return f'{thumbnail_settings.THUMBNAIL_PREFIX}{path}.{extension}'
+
+
+def modern_formats():
+    """Современные форматы, которые умеет сохранять установленный Pillow."""
+    Image.init()
+    return [(format_, mime) for format_, mime in MODERN_FORMATS
+            if format_ in Image.SAVE]
+
+
+def variants(geometry, options):
+    """
+    Варианты миниатюры для srcset: (mime, ширина, геометрия, опции)
+    с теми же пропорциями и кадрированием.
+    """
+    width, height = map(int, geometry.split('x'))
+    return [
+        (mime, size, f'{size}x{round(size * height / width)}',
+         {**options, 'format': format_})
+        for format_, mime in modern_formats()
+        for size in SRCSET_WIDTHS.get(geometry, ())
+    ]
+
+
+def generate(name):
+    """
+    Строит все миниатюры картинки и их варианты для srcset
+    и записывает их в хранилище ключей sorl-thumbnail, чтобы шаблоны
+    находили их без декодирования. Затем сбрасывает карточки постов
+    с этой картинкой и страницы, отрисованные до появления вариантов.
+    """
+    source = ImageFile(name, Post._meta.get_field('image').storage)
+    for geometry, options in GEOMETRIES:
+        get_thumbnail(source, geometry, **options)
+        for _, _, variant, variant_options in variants(geometry, options):
+            get_thumbnail(source, variant, **variant_options)
+    posts = Post.objects.filter(image=name).select_related('author', 'group')
+    for post in posts:
+        caching.invalidate_cards(post)
+    caching.bump_version('index')
+    caching.bump_version('pages')
+
+
+def delete_unreferenced(name):
+    """
+    Удаляет файл картинки вместе с миниатюрами, если за время
+    транзакции на него не сослался новый пост. Файлы вне хранилища
+    не трогаются.
+    """
+    with transaction.atomic():
+        # Запись берёт блокировку БД: новый пост не возьмёт ссылку
+        # на файл, пока проверка и удаление не закончатся.
+        MediaFile.objects.filter(name=name, refs=0).delete()
+        if MediaFile.objects.filter(name=name).exists():
+            return
+        try:
+            delete(ImageFile(name, Post._meta.get_field('image').storage))
+        except SuspiciousFileOperation:
+            # Путь вне хранилища: файл не наш, удалять нечего.
+            logger.warning('Картинка %s лежит вне хранилища', name)
+
+
+def get_executor():
+    """
+    Пул процессов для построения миниатюр. Процессы запускаются
+    через spawn и не наследуют соединения с БД родителя; Django
+    настраивается в них до загрузки этого модуля, поэтому они
+    работают с базой из настроек, а не с тестовой. Без пула
+    (THUMBNAIL_WORKERS = 0) возвращает None.
+    """
+    global _executor
+    if not settings.THUMBNAIL_WORKERS:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+    return _executor
+
+
+def submit(name):
+    """
+    Отправляет картинку в пул. Без пула (THUMBNAIL_WORKERS = 0)
+    миниатюры строятся сразу.
+    """
+    executor = get_executor()
+    if executor is None:
+        generate(name)
+        return
+    executor.submit(generate, name).add_done_callback(
+        caching.log_failure(logger, 'Не удалось построить миниатюры')
+    )
+
+
+def schedule(post):
+    """
+    Ставит построение миниатюр поста в очередь после фиксации
+    транзакции, когда файл и пост уже сохранены.
+    """
+    if post.image:
+        name = post.image.name
+        transaction.on_commit(lambda: submit(name))
+
+
+def thumbnail_file(file_, geometry, options):
+    """
+    Файл миниатюры без её построения. Опции дополняются так же,
+    как в ThumbnailBackend.get_thumbnail, иначе имя не совпадёт.
+    """
+    backend = default.backend
+    source = ImageFile(file_)
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(thumbnail_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def thumbnail_key(file_, geometry, options):
+    """Ключ миниатюры в хранилище sorl-thumbnail."""
+    return add_prefix(thumbnail_file(file_, geometry, options).key)
+
+
+def stored_sources(image, geometry):
+    """
+    Содержимое <source> для картинки: srcset по форматам из уже
+    построенных вариантов. Недостающие варианты не строятся,
+    это работа пайплайна.
+    """
+    sources = {}
+    for mime, width, variant, options in variants(geometry,
+                                                  dict(GEOMETRIES)[geometry]):
+        thumbnail = default.kvstore.get(thumbnail_file(image, variant,
+                                                       options))
+        if thumbnail is not None:
+            sources.setdefault(mime, []).append(f'{thumbnail.url} {width}w')
+    return [{'type': mime, 'srcset': ', '.join(srcset)}
+            for mime, srcset in sources.items()]
+
+
+def thumbnail_size(width, height, geometry):
+    """
+    Размер миниатюры geometry для картинки width x height: тот же
+    масштаб и кадрирование, что у sorl-thumbnail, но без обращения
+    к хранилищу миниатюр.
+    """
+    options = dict(GEOMETRIES)[geometry]
+    box_width, box_height = map(int, geometry.split('x'))
+    factors = (box_width / width, box_height / height)
+    factor = max(factors) if options.get('crop') else min(factors)
+    if not options.get('upscale'):
+        factor = min(factor, 1)
+    size = (max(round(width * factor), 1), max(round(height * factor), 1))
+    if options.get('crop'):
+        size = (min(size[0], box_width), min(size[1], box_height))
+    return size
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """
+    Хранилище ключей sorl-thumbnail, которое умеет читать ключи пачкой
+    и внутри prefetch_thumbnails отвечает из заранее выбранных значений.
+    """
+    def _get_raw(self, key):
+        prefetched = _prefetched.get()
+        if prefetched is None or key not in prefetched:
+            return super()._get_raw(key)
+        value = prefetched[key]
+        if value == cached_db_kvstore.EMPTY_VALUE:
+            return None
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        prefetched = _prefetched.get()
+        if prefetched is not None:
+            prefetched[key] = value
+
+    def get_many_raw(self, keys):
+        """Значения ключей: одним чтением кэша и одним запросом к БД."""
+        values = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = dict(KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list('key', 'value'))
+            for key in missing:
+                values[key] = found.get(key, cached_db_kvstore.EMPTY_VALUE)
+            self.cache.set_many({key: values[key] for key in missing},
+                                thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        return values
+
+
+@contextmanager
+def prefetch_thumbnails(images, geometry, options):
+    """
+    Заранее читает из хранилища ключи миниатюр всех картинок страницы
+    вместе с их вариантами, чтобы теги внутри блока не ходили в него
+    по одной.
+    """
+    thumbnails = [(geometry, options)]
+    thumbnails += [(variant, variant_options) for _, _, variant,
+                   variant_options in variants(geometry, options)]
+    keys = [thumbnail_key(image, *thumbnail)
+            for image in images if image
+            for thumbnail in thumbnails]
+    token = _prefetched.set(default.kvstore.get_many_raw(keys))
+    try:
+        yield
+    finally:
+        _prefetched.reset(token)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -8,13 +9,24 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('group/<slug:slug>/', views.group_list, name='group_list'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('tag/<str:name>/', views.tag_list, name='tag_list'),
+    path('search/', views.search, name='search'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
+    path('posts/<int:post_id>/comments/',
+         views.comments_chunk,
+         name='comments'),
     path('posts/<int:post_id>/comment/',
          views.add_comment,
          name='add_comment'),
     path('follow/', views.follow_index, name='follow_index'),
+    path(
+        f'{settings.MEDIA_URL.lstrip("/")}r/<int:width>x<int:height>/'
+        '<path:name>',
+        views.resized_image,
+        name='resized_image'
+    ),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
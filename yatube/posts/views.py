@@ -1,32 +1,51 @@
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponseForbidden
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 
-from .models import Post, Group, User, Follow
+from core.decorators import query_budget
+
+from . import resize
+from .caching import get_version, page_cache
+from .models import AuthorStats, Post, Group, Tag, User, Follow
 from .forms import PostForm, CommentForm
-from .helpers import paginate
+from .helpers import (paginate, paginate_comments, paginate_merged,
+                      paginate_search, paginate_tag)
+from .feeds import author_streams, timeline
+from .hashtags import tag_posts
+from .search import build_query
+from .thumbnails import schedule
 
 
+@page_cache('index', shared=True, fallback=True)
+@query_budget(6)
 def index(request):
     """
     Функция для отображения главной страницы index.
     """
-    posts = Post.objects.all()
-    page_obj = paginate(request, posts)
+    posts = Post.objects.select_related('author', 'group')
+    page_obj = paginate(request, posts, feed='global')
     context = {
         'page_obj': page_obj,
         'show_link': True,
+        'index_version': get_version('index'),
+        'cache_timeout': settings.INDEX_PAGE_CACHE_TIMEOUT,
     }
     return render(request, 'posts/index.html', context)
 
 
+@page_cache('group_list', shared=True, fallback=True)
+@query_budget(7)
 def group_list(request, slug):
     """
     Функция для отображения для вывода списка всех групп.
     """
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = paginate(request, posts)
+    posts = group.posts.select_related('author')
+    page_obj = paginate(request, posts, feed=f'group:{group.id}')
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -34,15 +53,17 @@ def group_list(request, slug):
     return render(request, template, context)
 
 
+@page_cache('profile')
+@query_budget(9)
 def profile(request, username):
     """
     Функция для отображения профиля пользователя.
     """
     author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
+    posts = author.posts.select_related('author', 'group')
     template = 'posts/profile.html'
-    page_obj = paginate(request, posts)
-    posts_count = posts.count()
+    page_obj = paginate(request, posts, feed=f'author:{author.id}')
+    posts_count = AuthorStats.for_author(author.id).posts_count
     is_auth = request.user.is_authenticated
     is_exist = Follow.objects.filter(user=request.user.id,
                                      author=author).exists()
@@ -58,13 +79,53 @@ def profile(request, username):
     return render(request, template, context)
 
 
+@query_budget(4)
+def tag_list(request, name):
+    """
+    Функция для отображения постов с хэштегом.
+    """
+    tag = get_object_or_404(Tag, name=name.lower())
+    page_obj = paginate_tag(request, tag_posts(tag))
+    context = {
+        'tag': tag,
+        'page_obj': page_obj,
+        'show_link': True,
+    }
+    return render(request, 'posts/tag_list.html', context)
+
+
+@query_budget(5)
+def search(request):
+    """
+    Функция для поиска постов по тексту.
+    """
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    # Без слов искать нечего: пустой ввод и одни знаки не ищутся.
+    if build_query(query):
+        posts = Post.objects.select_related('author', 'group')
+        page_obj = paginate_search(request, query, posts)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'show_link': True,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@page_cache('post_detail')
+@query_budget(7)
 def post_detail(request, post_id):
     """
     Функция для отображения страницы поста.
     """
-    post = get_object_or_404(Post, pk=post_id)
-    posts_count = post.author.posts.count()
-    comments = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id
+    )
+    posts_count = AuthorStats.for_author(post.author_id).posts_count
+    comments = paginate_comments(
+        request, post.comments.select_related('author')
+    )
     comment_form = CommentForm()
     context = {
         'post': post,
@@ -75,6 +136,22 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(3)
+def comments_chunk(request, post_id):
+    """
+    Функция для подгрузки следующей порции комментариев поста.
+    """
+    post = get_object_or_404(Post.objects.only('id'), pk=post_id)
+    comments = paginate_comments(
+        request, post.comments.select_related('author')
+    )
+    context = {
+        'post': post,
+        'comments': comments,
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
 @login_required
 def post_create(request):
     """
@@ -87,6 +164,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        schedule(post)
         return redirect('posts:profile', request.user)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -106,6 +184,8 @@ def post_edit(request, post_id):
                     instance=post)
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            schedule(post)
         return redirect('posts:post_detail', post_id=post_id)
 
     is_edit = True
@@ -134,12 +214,20 @@ def add_comment(request, post_id):
 
 
 @login_required
+@query_budget(7)
 def follow_index(request):
     """
     Функция для отображения всех подписок пользователя.
     """
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginate(request, posts)
+    strategy = request.GET.get('feed', settings.FEED_STRATEGY)
+    if strategy == 'merge':
+        streams = author_streams(request.user)
+        request.extra_queries = len(streams)
+        page_obj = paginate_merged(request, streams, Post)
+    else:
+        posts = timeline(request.user)
+        page_obj = paginate(request, posts,
+                            feed=f'follower:{request.user.id}')
     context = {
         'page_obj': page_obj,
         'show_link': True,
@@ -172,3 +260,32 @@ def profile_unfollow(request, username):
     if follow.exists():
         follow.delete()
     return redirect('posts:profile', username=username)
+
+
+def resized_etag(request, width, height, name):
+    return resize.cache_key(width, height, name)
+
+
+def resized_image(request, width, height, name):
+    """
+    Функция для отдачи картинки поста, уменьшенной до width x height.
+    Ссылка должна быть подписана, результат берётся из дискового кэша.
+    Подпись и наличие файла проверяются до ETag, чтобы неподписанный
+    запрос не получил 304.
+    """
+    sign = request.GET.get(resize.SIGNATURE_PARAM)
+    if not resize.is_allowed(width, height, name, sign):
+        return HttpResponseForbidden()
+    storage = Post._meta.get_field('image').storage
+    if not storage.exists(name):
+        raise Http404
+    return _resized_response(request, width, height, name)
+
+
+@condition(etag_func=resized_etag)
+def _resized_response(request, width, height, name):
+    file_, content_type = resize.get_or_create(name, width, height)
+    response = FileResponse(file_, content_type=content_type)
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365,
+                        immutable=True)
+    return response
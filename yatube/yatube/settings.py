@@ -66,6 +66,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+TEST_RUNNER = 'core.testing.TestRunner'
+
 
 DATABASES = {
     'default': {
@@ -116,12 +118,95 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Кэш в файле SQLite общий для всех процессов сервера; перед ним
+# у каждого процесса небольшой LRU для горячих ключей.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.tiered.TieredCache',
+        'OPTIONS': {
+            'CACHE': 'shared',
+            'MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            'POLL_INTERVAL': 1,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.sqlite.SQLiteCache',
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache.sqlite3')
+        ),
+        'OPTIONS': {
+            'MAX_SIZE': int(os.getenv('CACHE_MAX_SIZE',
+                                      default=256 * 1024 * 1024)),
+        },
+    },
 }
 
+INDEX_PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Защита от одновременной перерисовки: сколько устаревшее значение
+# ещё можно отдавать, сколько держится блокировка перерисовки,
+# насколько рано перерисовывать (beta из XFetch) и как часто
+# сбрасывать счётчики в общий кэш.
+CACHE_STALE_TIMEOUT = 60 * 60
+CACHE_LOCK_TIMEOUT = 30
+CACHE_EARLY_BETA = 1.0
+CACHE_STATS_INTERVAL = 10
+
+# Полные страницы для анонимных запросов.
+PAGE_CACHE_TIMEOUT = 60 * 5
+# Ленты с прежней отрисовкой ждут БД не дольше стольких секунд,
+# а устаревшие перерисовываются в фоне в стольких потоках процесса.
+PAGE_LATENCY_BUDGET = 0.5
+PAGE_REFRESH_WORKERS = int(os.getenv('PAGE_REFRESH_WORKERS', default=2))
+
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+FEED_COUNT_CACHE_TIMEOUT = 60 * 5
+
+# Снимок выдачи поиска, по которому листаются её страницы.
+SEARCH_SNAPSHOT_SIZE = 1000
+SEARCH_SNAPSHOT_TIMEOUT = 60 * 30
+
+POSTS_PAGINATION = os.getenv('POSTS_PAGINATION', default='offset')
+
+# Автор становится «звездой» при FEED_CELEBRITY_THRESHOLD подписчиков
+# и перестаёт ею быть, только опустившись ниже
+# FEED_CELEBRITY_LOW_THRESHOLD, чтобы не переключаться на каждой
+# подписке у порога.
+FEED_CELEBRITY_THRESHOLD = int(
+    os.getenv('FEED_CELEBRITY_THRESHOLD', default=10000)
+)
+FEED_CELEBRITY_LOW_THRESHOLD = int(
+    os.getenv('FEED_CELEBRITY_LOW_THRESHOLD', default=9000)
+)
+
+FEED_STRATEGY = os.getenv('FEED_STRATEGY', default='timeline')
+
+# Картинки постов при загрузке уменьшаются до этого размера
+# и пересохраняются с этим качеством JPEG.
+POST_IMAGE_MAX_SIZE = (2560, 2560)
+POST_IMAGE_QUALITY = 85
+
+# Ресайз картинок по подписанным ссылкам /media/r/<w>x<h>/<путь>:
+# предельный размер и дисковый кэш результатов с лимитом объёма.
+RESIZE_MAX_SIZE = (2560, 2560)
+RESIZE_CACHE_ROOT = os.path.join(BASE_DIR, 'resize_cache')
+RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Бэкенд миниатюр с поддержкой AVIF для вариантов srcset.
+THUMBNAIL_BACKEND = 'posts.thumbnails.ThumbnailBackend'
+
+# Хранилище ключей миниатюр с чтением пачкой для страниц лент.
+THUMBNAIL_KVSTORE = 'posts.thumbnails.KVStore'
+
+# Число процессов, строящих миниатюры после загрузки; 0 — без пула.
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', default=2))
+
+QUERY_BUDGET_STRICT = DEBUG
+# Хранилище ключей sorl-thumbnail — это кэш миниатюр, а не данные ленты.
+QUERY_BUDGET_IGNORE = ('thumbnail_kvstore',)
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'